@@ -0,0 +1,97 @@
+"""Per-product cost of the pandas merge based diff versus ChangeDetector.
+
+Usage: python -m benchmarks.diff_engine [products] [characteristics per product]
+"""
+import asyncio
+import sys
+import time
+
+import pandas as pd
+
+from source.product_management.diff import ChangeDetector
+from source.product_management.models import Product, Characteristic
+from source.product_management.records import ParsedProduct, ParsedCharacteristic
+
+
+async def legacy_detect_changes(detector, saved_products, saved_characteristics, parsed_products, parsed_characteristics):
+    """detect_changes as it was before ChangeDetector: a merge per catalog plus an outer merge per product."""
+    saved_products_df = pd.DataFrame([{'nm_id': product.nm_id, 'saved_product': product} for product in saved_products])
+    parsed_products_df = pd.DataFrame([{'nm_id': product.nm_id, 'parsed_product': product} for product in parsed_products])
+    df = pd.merge(saved_products_df, parsed_products_df, how='inner', left_on='nm_id', right_on='nm_id')
+    saved_characteristics_dict = detector.group_characteristics(saved_characteristics)
+    parsed_characteristics_dict = detector.group_characteristics(parsed_characteristics)
+
+    actions = []
+    for index in df.index:
+        saved_product = df['saved_product'][index]
+        parsed_product = df['parsed_product'][index]
+        _, history = await detector.detect_change_in_content(saved_product=saved_product, parsed_product=parsed_product)
+        actions += [item.action for item in history]
+
+        saved_df = pd.DataFrame([
+            {'nm_id': item.product_nm_id, 'keyword': item.name, 'saved_characteristic': item}
+            for item in saved_characteristics_dict.get(saved_product.nm_id, [])])
+        parsed_df = pd.DataFrame([
+            {'nm_id': item.product_nm_id, 'keyword': item.name, 'parsed_characteristic': item}
+            for item in parsed_characteristics_dict.get(parsed_product.nm_id, [])])
+        chars_df = pd.merge(saved_df, parsed_df, how='outer', left_on=['nm_id', 'keyword'], right_on=['nm_id', 'keyword'])
+        for char_index in chars_df.index:
+            saved = chars_df['saved_characteristic'][char_index]
+            parsed = chars_df['parsed_characteristic'][char_index]
+            if pd.isna(saved):
+                actions.append(f'Добавлена новая характеристика товара с названием {parsed.name} и со значением {parsed.value}')
+            elif pd.isna(parsed):
+                actions.append(f'Удалена характеристика товара с названием {saved.name} и со значением {saved.value}')
+            elif saved.value != parsed.value:
+                actions.append(f'Поменялось значение характеристики {saved.name} с {saved.value} на {parsed.value}')
+                saved.value = parsed.value
+    return actions
+
+
+def make_catalog(products, characteristics):
+    saved_products = [
+        Product(nm_id=nm_id, vendor_code=f'vc{nm_id}', brand='brand', name='name', description='description' * 20,
+                priceU=1000, salePriceU=900, clientSale=10, basicSale=5, shop_id=1, shops_supplier='supplier')
+        for nm_id in range(products)]
+    parsed_products = [
+        ParsedProduct(nm_id=nm_id, vendor_code=f'vc{nm_id}', brand='brand', name='name', description='description' * 20,
+                      priceU=1000, salePriceU=900, clientSale=10, basicSale=5, shop_id=1, shops_supplier='supplier')
+        for nm_id in range(products)]
+    for product in parsed_products[::10]:
+        product.name = 'new name'
+
+    saved_characteristics = [
+        Characteristic(product_nm_id=nm_id, name=f'option {index}', value='value')
+        for nm_id in range(products) for index in range(characteristics)]
+    parsed_characteristics = [
+        ParsedCharacteristic(product_nm_id=nm_id, name=f'option {index}', value='value' if (nm_id + index) % 7 else 'changed')
+        for nm_id in range(products) for index in range(1, characteristics + 1)]
+    return saved_products, saved_characteristics, parsed_products, parsed_characteristics
+
+
+async def measure(detect, products, characteristics):
+    catalog = make_catalog(products, characteristics)
+    started = time.perf_counter()
+    actions = await detect(*catalog)
+    return (time.perf_counter() - started) / products * 1e6, actions
+
+
+async def main(products, characteristics):
+    detector = ChangeDetector()
+
+    async def engine(*catalog):
+        *_, history = await detector.detect_changes(*catalog)
+        return [item.action for item in history]
+
+    legacy_cost, legacy_actions = await measure(
+        lambda *catalog: legacy_detect_changes(detector, *catalog), products, characteristics)
+    engine_cost, engine_actions = await measure(engine, products, characteristics)
+
+    assert sorted(legacy_actions) == sorted(engine_actions), 'history actions differ'
+    print(f'pandas merge:    {legacy_cost:8.1f} us/product')
+    print(f'ChangeDetector:  {engine_cost:8.1f} us/product ({legacy_cost / engine_cost:.0f}x)')
+
+
+if __name__ == '__main__':
+    args = [int(arg) for arg in sys.argv[1:]]
+    asyncio.run(main(*(args + [5000, 15][len(args):])))
@@ -0,0 +1,61 @@
+"""Compare a session per request with the shared HttpClient against a local stub.
+
+Usage: python -m benchmarks.http_client [requests] [concurrency]
+"""
+import asyncio
+import sys
+import time
+
+import aiohttp
+from aiohttp import web
+
+from source.core.base_utils import BaseUtils, http_client
+
+HOST = '127.0.0.1'
+PORT = 8765
+URL = f'http://{HOST}:{PORT}/card.json'
+
+
+async def card(request):
+    return web.json_response({'nm_id': 1, 'options': [{'name': 'Цвет', 'value': 'черный'}] * 20})
+
+
+async def session_per_request(url):
+    async with aiohttp.ClientSession(trust_env=True) as session:
+        async with session.get(url=url) as response:
+            return await response.json()
+
+
+async def measure(fetch, total, concurrency):
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def worker():
+        async with semaphore:
+            await fetch(URL)
+
+    started = time.perf_counter()
+    await asyncio.gather(*[worker() for _ in range(total)])
+    return total / (time.perf_counter() - started)
+
+
+async def main(total, concurrency):
+    app = web.Application()
+    app.router.add_get('/card.json', card)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, HOST, PORT).start()
+    try:
+        per_request = await measure(session_per_request, total, concurrency)
+        await http_client.start()
+        shared = await measure(lambda url: BaseUtils.make_get_request(url=url, headers={}), total, concurrency)
+        await http_client.close()
+    finally:
+        await runner.cleanup()
+
+    print(f'session per request: {per_request:8.0f} req/s')
+    print(f'shared http client:  {shared:8.0f} req/s ({shared / per_request:.1f}x)')
+
+
+if __name__ == '__main__':
+    args = [int(arg) for arg in sys.argv[1:]]
+    asyncio.run(main(*(args + [5000, 50][len(args):])))
@@ -0,0 +1,109 @@
+"""Cost of turning parsed cards into ORM Product/Characteristic objects versus slotted records.
+
+Every variant runs in a fresh process: wall time, peak RSS growth and the bytes traced by
+tracemalloc for the objects that stay alive.
+
+Usage: python -m benchmarks.parse_records [cards] [options per card]
+"""
+import gc
+import multiprocessing
+import resource
+import sys
+import time
+import tracemalloc
+
+from source.product_management.models import Product, Characteristic
+from source.product_management.utils import ProductUtils
+
+
+def legacy_prepare_products_for_saving(products):
+    """prepare_products_for_saving as it was before the records: an ORM instance per product and option."""
+    products_to_be_saved = []
+    characteristics_to_be_saved = []
+    for product in products:
+        extended = product['detail'].get('extended', {})
+        product_to_be_saved = Product(
+            nm_id=product['card'].get('nm_id'),
+            vendor_code=product['card'].get('vendor_code'),
+            brand=product['detail'].get('brand'),
+            subj_name=product['card'].get('subj_root_name'),
+            subj_root_name=product['card'].get('subj_name'),
+            imt_name=product['card'].get('imt_name'),
+            name=product['detail'].get('name'),
+            description=product['card'].get('description'),
+            priceU=product['detail'].get('priceU', 0) // 100,
+            salePriceU=product['detail'].get('salePriceU', 0) // 100,
+            clientSale=extended.get('clientSale'),
+            basicSale=extended.get('basicSale'),
+        )
+        products_to_be_saved.append(product_to_be_saved)
+        for option in product['card'].get('options', []):
+            characteristics_to_be_saved.append(Characteristic(
+                name=option.get('name'),
+                value=option.get('value'),
+                product_nm_id=product_to_be_saved.nm_id
+            ))
+    return products_to_be_saved, characteristics_to_be_saved
+
+
+VARIANTS = {
+    'ORM objects': legacy_prepare_products_for_saving,
+    'slotted records': ProductUtils.prepare_products_for_saving,
+}
+
+
+def make_cards(cards, options):
+    return [
+        {
+            'card': {
+                'nm_id': nm_id, 'vendor_code': f'vc{nm_id}', 'subj_name': 'subject', 'subj_root_name': 'root',
+                'imt_name': 'imt', 'description': f'description {nm_id} ' * 20,
+                'options': [{'name': f'option {index}', 'value': f'value {nm_id % 50}'} for index in range(options)],
+            },
+            'detail': {
+                'id': nm_id, 'brand': 'brand', 'name': f'name {nm_id}', 'priceU': 100000, 'salePriceU': 90000,
+                'extended': {'clientSale': 10, 'basicSale': 5},
+            },
+            'card_unchanged': False,
+        }
+        for nm_id in range(cards)
+    ]
+
+
+def measure(variant, cards, options, results):
+    prepare = VARIANTS[variant]
+    fixture = make_cards(cards, options)
+    gc.collect()
+
+    rss_before = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    started = time.perf_counter()
+    parsed = prepare(fixture)
+    elapsed = time.perf_counter() - started
+    rss_growth = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss - rss_before
+    del parsed
+    gc.collect()
+
+    tracemalloc.start()
+    parsed = prepare(fixture)
+    retained, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    results.put((elapsed, rss_growth, retained, peak, len(parsed[0]) + len(parsed[1])))
+
+
+def main(cards, options):
+    context = multiprocessing.get_context('spawn')
+    print(f'{cards} cards, {options} options each')
+    for variant in VARIANTS:
+        results = context.Queue()
+        process = context.Process(target=measure, args=(variant, cards, options, results))
+        process.start()
+        elapsed, rss_growth, retained, peak, objects = results.get()
+        process.join()
+        print(f'{variant:16} {elapsed:6.2f} s  rss +{rss_growth / 1024:7.1f} MiB  '
+              f'retained {retained / 2 ** 20:7.1f} MiB  peak {peak / 2 ** 20:7.1f} MiB  '
+              f'{retained / objects:5.0f} B/object')
+
+
+if __name__ == '__main__':
+    args = [int(arg) for arg in sys.argv[1:]]
+    main(*(args + [100000, 15][len(args):]))
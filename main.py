@@ -3,9 +3,14 @@ from source.core.routes import router as main_router
 from sqladmin import Admin
 import uvicorn
 
+from source.core.base_utils import http_client
+from source.core.scheduler import scheduler
 from source.db.db import async_engine
+from source.job_management.admin import JobAdmin
+from source.job_management.runner import job_runner
 from source.product_management.admin import ProductAdmin, ProductHistoryAdmin, CharacteristicAdmin, ShopAdmin, \
-    OrderAdmin
+    OrderAdmin, OutboxEventAdmin
+from source.product_management.jobs import register_jobs
 
 app = FastAPI(title='Мониторинг товаров WB')
 app.include_router(router=main_router)
@@ -18,6 +23,23 @@ admin.add_view(view=ProductAdmin)
 admin.add_view(view=CharacteristicAdmin)
 admin.add_view(view=ProductHistoryAdmin)
 admin.add_view(view=OrderAdmin)
+admin.add_view(view=OutboxEventAdmin)
+admin.add_view(view=JobAdmin)
+
+
+@app.on_event('startup')
+async def startup():
+    await http_client.start()
+    register_jobs(scheduler=scheduler, job_runner=job_runner)
+    await job_runner.start()
+    scheduler.start()
+
+
+@app.on_event('shutdown')
+async def shutdown():
+    await scheduler.stop()
+    await job_runner.stop()
+    await http_client.close()
 
 
 if __name__ == '__main__':
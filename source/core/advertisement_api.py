@@ -5,16 +5,21 @@ from source.db.db import get_session, async_session
 
 
 class AdvertisementApiUtils(BaseUtils):
+    outbox_destination = 'advertisement'
 
-    async def send_detected_changes(self, detected_changes):
-        url = settings.ADVERTISEMENT_PROJECT_HOST + '/api/v1/external-api/save-stats-to-detected-changes/'
-        payload_changes = []
+    @staticmethod
+    def detected_change_payload(change) -> dict:
+        return {
+            'nm_id': change.nm_id,
+            'action': change.action,
+            'shop_supplier': change.shops_supplier,
+            'time': str(change.created_at)
+        }
 
-        for change in detected_changes:
-            payload_changes.append({
-                'nm_id': change.nm_id,
-                'action': change.action,
-                'shop_supplier': change.shops_supplier,
-                'time': str(change.created_at)
-            })
-        await self.make_post_request(url=url, payload=dict(data=payload_changes), headers={}, no_json=True)
+    async def send_detected_changes(self, payload_changes: list[dict], idempotency_key: str) -> None:
+        """Posts one batch, its key goes into the Idempotency-Key header; raises unless the service answers 200."""
+        url = settings.ADVERTISEMENT_PROJECT_HOST + '/api/v1/external-api/save-stats-to-detected-changes/'
+        sent = await self.make_post_request(
+            url=url, payload=dict(data=payload_changes), headers={'Idempotency-Key': idempotency_key}, no_json=True)
+        if not sent:
+            raise RuntimeError(f'advertisement service rejected a batch of {len(payload_changes)} changes')
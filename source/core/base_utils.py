@@ -1,29 +1,152 @@
+import asyncio
+import itertools
 import json
+import time
+import typing
 
 import aiohttp
+from yarl import URL
+
+from source.core.settings import settings
+
+
+class HttpClient:
+    """Application-scoped aiohttp session, keeps connections and DNS lookups alive between BaseUtils requests."""
+
+    def __init__(self):
+        self._session: aiohttp.ClientSession | None = None
+        self._host_semaphores: dict[str, asyncio.Semaphore] = {}
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            self._session = self._create_session()
+        return self._session
+
+    @staticmethod
+    def _create_session() -> aiohttp.ClientSession:
+        connector = aiohttp.TCPConnector(
+            limit=settings.HTTP_POOL_LIMIT,
+            limit_per_host=settings.HTTP_POOL_LIMIT_PER_HOST,
+            ttl_dns_cache=settings.HTTP_DNS_CACHE_TTL,
+            keepalive_timeout=settings.HTTP_KEEPALIVE_TIMEOUT,
+        )
+        timeout = aiohttp.ClientTimeout(
+            total=None, sock_connect=settings.HTTP_TIMEOUT, sock_read=settings.HTTP_TIMEOUT)
+        return aiohttp.ClientSession(connector=connector, timeout=timeout, trust_env=settings.HTTP_TRUST_ENV)
+
+    def host_semaphore(self, url: str) -> asyncio.Semaphore:
+        """Caps in-flight requests per host, HTTP_HOST_CONCURRENCY overrides the default."""
+        host = URL(url).host
+        if host not in self._host_semaphores:
+            limit = settings.HTTP_HOST_CONCURRENCY.get(host, settings.HTTP_POOL_LIMIT_PER_HOST)
+            self._host_semaphores[host] = asyncio.Semaphore(limit)
+        return self._host_semaphores[host]
+
+    async def start(self) -> None:
+        self._session = self.session
+
+    async def close(self) -> None:
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+        self._host_semaphores = {}
+
+
+http_client = HttpClient()
+
+
+class TokenBucket:
+    """Allows `rate` acquisitions per second on average with bursts of up to `capacity`."""
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = float(capacity)
+        self.updated_at = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+
+class RateLimiter:
+    """One TokenBucket per key, e.g. per API token."""
+
+    def __init__(self, rate: float, capacity: int):
+        self.rate = rate
+        self.capacity = capacity
+        self._buckets: dict[str, TokenBucket] = {}
+
+    async def acquire(self, key: str) -> None:
+        if key not in self._buckets:
+            self._buckets[key] = TokenBucket(rate=self.rate, capacity=self.capacity)
+        await self._buckets[key].acquire()
 
 
 class BaseUtils:
 
     @staticmethod
     async def make_get_request(url, headers, no_json=False):
-        timeout_seconds = 500
-        session_timeout = aiohttp.ClientTimeout(total=None, sock_connect=timeout_seconds, sock_read=timeout_seconds)
-        async with aiohttp.ClientSession(trust_env=True, headers=headers, timeout=session_timeout) as session:
-            async with session.get(url=url) as response:
+        async with http_client.host_semaphore(url):
+            async with http_client.session.get(url=url, headers=headers) as response:
                 if response.status == 200:
                     return True if no_json else json.loads(await response.text())
 
     @staticmethod
     async def make_post_request(url, headers, payload, no_json=False):
-        timeout_seconds = 500
-        session_timeout = aiohttp.ClientTimeout(total=None, sock_connect=timeout_seconds, sock_read=timeout_seconds)
-        async with aiohttp.ClientSession(trust_env=True, headers=headers, timeout=session_timeout) as session:
-            async with session.post(url=url, json=payload) as response:
+        async with http_client.host_semaphore(url):
+            async with http_client.session.post(url=url, headers=headers, json=payload) as response:
 
                 if response.status == 200:
                     return True if no_json else json.loads(await response.text())
 
+    @staticmethod
+    async def make_conditional_get_request(url, headers) -> tuple[int, bytes | None, dict]:
+        """Returns status, raw body (200 only) and response headers, so callers can honour 304s."""
+        async with http_client.host_semaphore(url):
+            async with http_client.session.get(url=url, headers=headers) as response:
+                body = await response.read() if response.status == 200 else None
+                return response.status, body, dict(response.headers)
+
+    @staticmethod
+    async def stream_concurrently(
+            items: typing.Iterable, worker: typing.Callable[[typing.Any], typing.Awaitable],
+            concurrency: int) -> typing.AsyncIterator:
+        """Keeps up to `concurrency` calls in flight, yields results in completion order, drops failed ones."""
+        items = iter(items)
+        pending = {asyncio.create_task(worker(item)) for item in itertools.islice(items, concurrency)}
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for item in itertools.islice(items, len(done)):
+                    pending.add(asyncio.create_task(worker(item)))
+                for task in done:
+                    if not task.exception() and task.result():
+                        yield task.result()
+        finally:
+            for task in pending:
+                task.cancel()
+
+    @staticmethod
+    async def chunked(stream: typing.AsyncIterable, size: int) -> typing.AsyncIterator[list]:
+        chunk = []
+        async for item in stream:
+            chunk.append(item)
+            if len(chunk) >= size:
+                yield chunk
+                chunk = []
+        if chunk:
+            yield chunk
+
     @staticmethod
     def make_head(article: int):
         head = 'https://basket-{i}.wb.ru'
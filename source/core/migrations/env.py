@@ -30,10 +30,17 @@ target_metadata = Base.metadata
 # ... etc.
 
 
+# partitions of these tables are created at runtime, not by migrations
+partitioned_tables = tuple(f'{table.name}_' for table in target_metadata.tables.values() if table.info.get('partitioned'))
+
+
 def include_object(obj, name, type_, reflected, compare_to):
     if obj.info.get("skip_autogen", False):
         return False
 
+    if type_ == 'table' and reflected and compare_to is None and name.startswith(partitioned_tables):
+        return False
+
     return True
 
 
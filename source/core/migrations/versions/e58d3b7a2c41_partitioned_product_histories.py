@@ -0,0 +1,98 @@
+"""partitioned product histories
+
+Revision ID: e58d3b7a2c41
+Revises: 6c2e8a4f1b97
+Create Date: 2026-10-18 17:02:18.645930
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e58d3b7a2c41'
+down_revision = '6c2e8a4f1b97'
+branch_labels = None
+depends_on = None
+
+
+def rename_old_table(table: str, old_table: str) -> None:
+    op.rename_table(table, old_table)
+    op.execute(f'ALTER TABLE {old_table} RENAME CONSTRAINT {table}_pkey TO {old_table}_pkey')
+    op.execute(f'ALTER TABLE {old_table} RENAME CONSTRAINT {table}_shop_id_fkey TO {old_table}_shop_id_fkey')
+    op.execute(f'ALTER INDEX ix_{table}_created_at RENAME TO ix_{old_table}_created_at')
+    op.execute(f'ALTER INDEX ix_{table}_nm_id RENAME TO ix_{old_table}_nm_id')
+
+
+def upgrade() -> None:
+    rename_old_table('product_histories', 'product_histories_old')
+
+    op.create_table('product_histories',
+    sa.Column('id', sa.Integer(), server_default=sa.text("nextval('product_histories_id_seq'::regclass)"), nullable=False),
+    sa.Column('nm_id', sa.BIGINT(), nullable=True),
+    sa.Column('action', sa.String(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=False),
+    sa.Column('shops_supplier', sa.String(), nullable=True),
+    sa.Column('shop_id', sa.Integer(), nullable=True),
+    sa.Column('price_for_sale', sa.Integer(), nullable=True),
+    sa.ForeignKeyConstraint(['shop_id'], ['shops.id'], name='product_histories_shop_id_fkey'),
+    sa.PrimaryKeyConstraint('id', 'created_at'),
+    postgresql_partition_by='RANGE (created_at)'
+    )
+    op.create_index(op.f('ix_product_histories_created_at'), 'product_histories', ['created_at'], unique=False)
+    op.create_index(op.f('ix_product_histories_nm_id'), 'product_histories', ['nm_id'], unique=False)
+    op.execute('ALTER SEQUENCE product_histories_id_seq OWNED BY product_histories.id')
+
+    # rows of months without a partition of their own land in the default one until
+    # the partition maintenance job creates it
+    op.execute('CREATE TABLE product_histories_default PARTITION OF product_histories DEFAULT')
+    op.execute("""
+        DO $$
+        DECLARE
+            month date;
+        BEGIN
+            FOR month IN
+                SELECT generate_series(
+                    date_trunc('month', coalesce((SELECT min(created_at) FROM product_histories_old), now())),
+                    date_trunc('month', now()) + interval '3 months',
+                    interval '1 month'
+                )::date
+            LOOP
+                EXECUTE format(
+                    'CREATE TABLE %I PARTITION OF product_histories FOR VALUES FROM (%L) TO (%L)',
+                    'product_histories_p' || to_char(month, 'YYYY_MM'), month, month + interval '1 month'
+                );
+            END LOOP;
+        END $$
+    """)
+    op.execute("""
+        INSERT INTO product_histories (id, nm_id, action, created_at, shops_supplier, shop_id, price_for_sale)
+        SELECT id, nm_id, action, coalesce(created_at, now()), shops_supplier, shop_id, price_for_sale
+        FROM product_histories_old
+    """)
+    op.drop_table('product_histories_old')
+
+
+def downgrade() -> None:
+    rename_old_table('product_histories', 'product_histories_partitioned')
+
+    op.create_table('product_histories',
+    sa.Column('id', sa.Integer(), server_default=sa.text("nextval('product_histories_id_seq'::regclass)"), nullable=False),
+    sa.Column('nm_id', sa.BIGINT(), nullable=True),
+    sa.Column('action', sa.String(), nullable=True),
+    sa.Column('created_at', sa.DateTime(), nullable=True),
+    sa.Column('shops_supplier', sa.String(), nullable=True),
+    sa.Column('shop_id', sa.Integer(), nullable=True),
+    sa.Column('price_for_sale', sa.Integer(), nullable=True),
+    sa.ForeignKeyConstraint(['shop_id'], ['shops.id'], name='product_histories_shop_id_fkey'),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_index(op.f('ix_product_histories_created_at'), 'product_histories', ['created_at'], unique=False)
+    op.create_index(op.f('ix_product_histories_nm_id'), 'product_histories', ['nm_id'], unique=False)
+    op.execute('ALTER SEQUENCE product_histories_id_seq OWNED BY product_histories.id')
+    op.execute("""
+        INSERT INTO product_histories (id, nm_id, action, created_at, shops_supplier, shop_id, price_for_sale)
+        SELECT id, nm_id, action, created_at, shops_supplier, shop_id, price_for_sale
+        FROM product_histories_partitioned
+    """)
+    op.drop_table('product_histories_partitioned')
@@ -1,4 +1,5 @@
 from fastapi import APIRouter
+from source.job_management.routes import router as job_router
 from source.product_management.routes import router as product_router
 
 
@@ -6,3 +7,4 @@ router = APIRouter(prefix='/api/v1')
 
 
 router.include_router(router=product_router)
+router.include_router(router=job_router)
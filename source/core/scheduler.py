@@ -0,0 +1,51 @@
+import asyncio
+import dataclasses
+import random
+import traceback
+
+from source.job_management.runner import JobRunner, job_runner
+
+
+@dataclasses.dataclass
+class ScheduledJob:
+    name: str
+    interval: int
+    jitter: int = 0
+
+
+class Scheduler:
+    """Enqueues registered jobs on the JobRunner every `interval` seconds, plus up to `jitter`."""
+
+    def __init__(self, job_runner: JobRunner):
+        self.job_runner = job_runner
+        self.jobs: dict[str, ScheduledJob] = {}
+        self._tasks: set[asyncio.Task] = set()
+
+    def add_job(self, name: str, interval: int, jitter: int = 0) -> None:
+        if name not in self.job_runner.handlers:
+            raise KeyError(name)
+        self.jobs[name] = ScheduledJob(name=name, interval=interval, jitter=jitter)
+
+    async def _loop(self, job: ScheduledJob) -> None:
+        while True:
+            await asyncio.sleep(random.uniform(0, job.jitter))
+            try:
+                await self.job_runner.enqueue(name=job.name)
+            except Exception:
+                traceback.print_exc()
+            await asyncio.sleep(job.interval)
+
+    def start(self) -> None:
+        for job in self.jobs.values():
+            if job.interval > 0:
+                task = asyncio.ensure_future(self._loop(job))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+
+    async def stop(self) -> None:
+        for task in list(self._tasks):
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+
+
+scheduler = Scheduler(job_runner=job_runner)
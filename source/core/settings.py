@@ -1,6 +1,19 @@
+import os
+import tempfile
+
 from decouple import config
 
 
+def host_limits(value: str) -> dict[str, int]:
+    """Parses "card.wb.ru:20,basket-01.wb.ru:10" into {'card.wb.ru': 20, 'basket-01.wb.ru': 10}."""
+    limits = {}
+    for item in value.split(','):
+        if item.strip():
+            host, limit = item.rsplit(':', 1)
+            limits[host.strip()] = int(limit)
+    return limits
+
+
 class Settings:
     POSTGRES_USER = config('POSTGRES_USER')
     POSTGRES_PASSWORD = config('POSTGRES_PASSWORD')
@@ -13,5 +26,65 @@ class Settings:
 
     ADVERTISEMENT_PROJECT_HOST = config('ADVERTISEMENT_PROJECT_HOST')
 
+    HTTP_POOL_LIMIT = config('HTTP_POOL_LIMIT', default=200, cast=int)
+    HTTP_POOL_LIMIT_PER_HOST = config('HTTP_POOL_LIMIT_PER_HOST', default=50, cast=int)
+    HTTP_DNS_CACHE_TTL = config('HTTP_DNS_CACHE_TTL', default=300, cast=int)
+    HTTP_KEEPALIVE_TIMEOUT = config('HTTP_KEEPALIVE_TIMEOUT', default=30, cast=int)
+    HTTP_TIMEOUT = config('HTTP_TIMEOUT', default=500, cast=int)
+    HTTP_TRUST_ENV = config('HTTP_TRUST_ENV', default=True, cast=bool)
+    HTTP_HOST_CONCURRENCY = config('HTTP_HOST_CONCURRENCY', default='', cast=host_limits)
+
+    PARSING_CONCURRENCY = config('PARSING_CONCURRENCY', default=100, cast=int)
+    DETAIL_BATCH_SIZE = config('DETAIL_BATCH_SIZE', default=100, cast=int)
+    DETAIL_BATCH_CONCURRENCY = config('DETAIL_BATCH_CONCURRENCY', default=10, cast=int)
+    PARSING_PERSIST_CHUNK_SIZE = config('PARSING_PERSIST_CHUNK_SIZE', default=1000, cast=int)
+
+    DB_BULK_CHUNK_SIZE = config('DB_BULK_CHUNK_SIZE', default=10000, cast=int)
+    DB_STREAM_CHUNK_SIZE = config('DB_STREAM_CHUNK_SIZE', default=10000, cast=int)
+
+    CARD_CACHE_MAX_SIZE = config('CARD_CACHE_MAX_SIZE', default=1000000, cast=int)
+
+    WB_API_RATE_LIMIT = config('WB_API_RATE_LIMIT', default=5, cast=float)
+    WB_API_RATE_BURST = config('WB_API_RATE_BURST', default=10, cast=int)
+    SHOP_MONITORING_CONCURRENCY = config('SHOP_MONITORING_CONCURRENCY', default=10, cast=int)
+    ORDER_STATUS_CHUNK_SIZE = config('ORDER_STATUS_CHUNK_SIZE', default=1000, cast=int)
+    ORDER_STATUS_CONCURRENCY = config('ORDER_STATUS_CONCURRENCY', default=5, cast=int)
+
+    JOB_WORKERS = config('JOB_WORKERS', default=2, cast=int)
+    JOB_LONG_WORKERS = config('JOB_LONG_WORKERS', default=2, cast=int)
+    JOB_FILES_DIR = config('JOB_FILES_DIR', default=tempfile.gettempdir())
+    JOB_RETENTION_DAYS = config('JOB_RETENTION_DAYS', default=7, cast=int)
+    IMPORT_CHUNK_SIZE = config('IMPORT_CHUNK_SIZE', default=1000, cast=int)
+
+    PRODUCT_MONITORING_SHARDS = config('PRODUCT_MONITORING_SHARDS', default=16, cast=int)
+    SHARD_LEASE_TTL = config('SHARD_LEASE_TTL', default=10 * 60, cast=int)
+    SHARD_POLL_INTERVAL = config('SHARD_POLL_INTERVAL', default=30, cast=int)
+    SHARD_WORKER_PROCESSES = config('SHARD_WORKER_PROCESSES', default=os.cpu_count() or 1, cast=int)
+
+    # months of product history kept, 0 keeps everything; dropped months are written to
+    # PRODUCT_HISTORY_ARCHIVE_DIR as csv.gz first unless it is empty
+    PRODUCT_HISTORY_RETENTION_MONTHS = config('PRODUCT_HISTORY_RETENTION_MONTHS', default=0, cast=int)
+    PRODUCT_HISTORY_ARCHIVE_DIR = config('PRODUCT_HISTORY_ARCHIVE_DIR', default='')
+    PRODUCT_HISTORY_PREMAKE_MONTHS = config('PRODUCT_HISTORY_PREMAKE_MONTHS', default=3, cast=int)
+
+    # outbox delivery to the advertisement service, delays are in seconds
+    OUTBOX_BATCH_SIZE = config('OUTBOX_BATCH_SIZE', default=500, cast=int)
+    OUTBOX_DISPATCH_CONCURRENCY = config('OUTBOX_DISPATCH_CONCURRENCY', default=4, cast=int)
+    OUTBOX_LEASE_TTL = config('OUTBOX_LEASE_TTL', default=10 * 60, cast=int)
+    OUTBOX_MAX_ATTEMPTS = config('OUTBOX_MAX_ATTEMPTS', default=20, cast=int)
+    OUTBOX_RETRY_BASE_DELAY = config('OUTBOX_RETRY_BASE_DELAY', default=10, cast=int)
+    OUTBOX_RETRY_MAX_DELAY = config('OUTBOX_RETRY_MAX_DELAY', default=60 * 60, cast=int)
+
+    # seconds between runs, 0 leaves the job to be triggered through its route only
+    PRICE_MONITORING_INTERVAL = config('PRICE_MONITORING_INTERVAL', default=15 * 60, cast=int)
+    PRODUCT_MONITORING_INTERVAL = config('PRODUCT_MONITORING_INTERVAL', default=6 * 60 * 60, cast=int)
+    ORDER_MONITORING_INTERVAL = config('ORDER_MONITORING_INTERVAL', default=10 * 60, cast=int)
+    ORDER_STATUS_MONITORING_INTERVAL = config('ORDER_STATUS_MONITORING_INTERVAL', default=10 * 60, cast=int)
+    HISTORY_PARTITION_MAINTENANCE_INTERVAL = config(
+        'HISTORY_PARTITION_MAINTENANCE_INTERVAL', default=24 * 60 * 60, cast=int)
+    JOB_CLEANUP_INTERVAL = config('JOB_CLEANUP_INTERVAL', default=24 * 60 * 60, cast=int)
+    OUTBOX_DISPATCH_INTERVAL = config('OUTBOX_DISPATCH_INTERVAL', default=30, cast=int)
+    SCHEDULER_JITTER = config('SCHEDULER_JITTER', default=30, cast=int)
+
 
 settings = Settings()
@@ -1,16 +1,156 @@
+import asyncio
+import csv
+import itertools
+import tempfile
 import zipfile
+import zlib
 import os
 import io
+import openpyxl
 import pandas as pd
-from starlette.responses import Response, StreamingResponse
+import xlsxwriter
+from starlette.responses import StreamingResponse
 import typing
 
 
 class XlsxUtils:
 
     @staticmethod
-    def zip_response(filenames, zip_filename):
-        s = io.BytesIO()
+    def iter_column(path: str, column: str) -> typing.Iterator:
+        """Values of the column titled `column`, row by row, without loading the sheet."""
+        if path.endswith('.csv'):
+            with open(path, newline='', encoding='utf-8-sig') as file:
+                rows = csv.reader(file)
+                header = next(rows, [])
+                if column not in header:
+                    raise ValueError(f'Column "{column}" not found')
+                index = header.index(column)
+                for row in rows:
+                    yield row[index] if index < len(row) else None
+            return
+
+        workbook = openpyxl.load_workbook(path, read_only=True, data_only=True)
+        try:
+            rows = workbook.active.iter_rows(values_only=True)
+            header = list(next(rows, []))
+            if column not in header:
+                raise ValueError(f'Column "{column}" not found')
+            index = header.index(column)
+            for row in rows:
+                yield row[index] if index < len(row) else None
+        finally:
+            workbook.close()
+
+    @staticmethod
+    def count_rows(path: str) -> int | None:
+        """Data rows of an .xlsx file as recorded in its dimensions, None when unknown."""
+        if path.endswith('.csv'):
+            return None
+        workbook = openpyxl.load_workbook(path, read_only=True)
+        try:
+            max_row = workbook.active.max_row
+            return max_row - 1 if max_row else None
+        finally:
+            workbook.close()
+
+    @classmethod
+    async def read_column_chunks(
+            cls, path: str, column: str, chunk_size: int, skip: int = 0) -> typing.AsyncIterator[list]:
+        """iter_column in chunks of chunk_size, read in a thread so the event loop is not blocked."""
+        values = cls.iter_column(path=path, column=column)
+        if skip:
+            await asyncio.to_thread(lambda: next(itertools.islice(values, skip - 1, skip), None))
+        while True:
+            chunk = await asyncio.to_thread(lambda: list(itertools.islice(values, chunk_size)))
+            if not chunk:
+                return
+            yield chunk
+
+    media_types = {
+        'csv': 'text/csv',
+        'csv.gz': 'application/gzip',
+        'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+    }
+    xlsx_max_rows = 1048576
+
+    @staticmethod
+    def iter_file(file: typing.BinaryIO, chunk_size: int = 1 << 16) -> typing.Iterator[bytes]:
+        with file:
+            file.seek(0)
+            while data := file.read(chunk_size):
+                yield data
+
+    @staticmethod
+    async def iter_csv(
+            header: list[str], chunks: typing.AsyncIterable[list], compress: bool = False) -> typing.AsyncIterator[bytes]:
+        """CSV (utf-8 with BOM, so Excel opens it) encoded chunk by chunk, gzipped on the fly with compress."""
+        compressor = zlib.compressobj(wbits=zlib.MAX_WBITS | 16) if compress else None
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+
+        def flush() -> bytes:
+            data = buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+            return compressor.compress(data) if compressor else data
+
+        buffer.write('\ufeff')
+        writer.writerow(header)
+        yield flush()
+        async for chunk in chunks:
+            writer.writerows(chunk)
+            if data := flush():
+                yield data
+        if compressor:
+            yield compressor.flush()
+
+    @classmethod
+    async def iter_xlsx(cls, header: list[str], chunks: typing.AsyncIterable[list]) -> typing.AsyncIterator[bytes]:
+        """Workbook written by xlsxwriter in constant_memory mode to a temporary file, then streamed from it."""
+        with tempfile.TemporaryFile() as file:
+            workbook = xlsxwriter.Workbook(file, {
+                'constant_memory': True, 'remove_timezone': True, 'default_date_format': 'yyyy-mm-dd hh:mm:ss'})
+            worksheet = None
+            row_index = cls.xlsx_max_rows
+
+            def write_rows(rows: list) -> None:
+                nonlocal worksheet, row_index
+                for row in rows:
+                    if row_index == cls.xlsx_max_rows:
+                        worksheet = workbook.add_worksheet()
+                        worksheet.write_row(0, 0, header)
+                        row_index = 1
+                    worksheet.write_row(row_index, 0, row)
+                    row_index += 1
+
+            async for chunk in chunks:
+                await asyncio.to_thread(write_rows, chunk)
+            if worksheet is None:
+                workbook.add_worksheet().write_row(0, 0, header)
+            await asyncio.to_thread(workbook.close)
+
+            file.seek(0)
+            while data := await asyncio.to_thread(file.read, 1 << 16):
+                yield data
+
+    @classmethod
+    def export_response(
+            cls, header: list[str], chunks: typing.AsyncIterable[list],
+            file_name: str, file_format: str) -> StreamingResponse:
+        """Streams the rows as csv, csv.gz or xlsx without holding the export in memory."""
+        if file_format == 'xlsx':
+            body = cls.iter_xlsx(header=header, chunks=chunks)
+        elif file_format in ['csv', 'csv.gz']:
+            body = cls.iter_csv(header=header, chunks=chunks, compress=file_format == 'csv.gz')
+        else:
+            raise ValueError(f'Unknown export format {file_format}')
+        return StreamingResponse(body, media_type=cls.media_types[file_format], headers={
+            'Content-Disposition': f'attachment; filename="{file_name}.{file_format}"'
+        })
+
+    @classmethod
+    def zip_response(cls, filenames, zip_filename):
+        s = tempfile.TemporaryFile()
         zf = zipfile.ZipFile(s, "w")
 
         for fpath in filenames:
@@ -23,7 +163,7 @@ class XlsxUtils:
         for file in filenames:
             os.remove(file)
 
-        resp = Response(s.getvalue(), media_type="application/x-zip-compressed", headers={
+        resp = StreamingResponse(cls.iter_file(s), media_type="application/x-zip-compressed", headers={
             'Content-Disposition': f'attachment;filename={zip_filename}'
         })
         return resp
@@ -34,8 +174,9 @@ class XlsxUtils:
         output = io.BytesIO()
         writer = pd.ExcelWriter(output, engine='xlsxwriter')
         df.to_excel(writer, index=False)
-        writer.save()
+        writer.close()
+        output.seek(0)
 
-        return StreamingResponse(io.BytesIO(output.getvalue()),
+        return StreamingResponse(output,
                                  media_type='application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
                                  headers={'Content-Disposition': f'attachment; filename="{file_name}.xlsx"'})
\ No newline at end of file
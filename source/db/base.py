@@ -1,2 +1,4 @@
 from source.db.db import Base
-from source.product_management.models import Product, Characteristic, ProductHistory
+from source.product_management.models import Product, Characteristic, ProductHistory, CardCache, OrderCursor, \
+    ProductEventRollup, OutboxEvent, CardCacheDailyStats
+from source.job_management.models import Job, ShardLease
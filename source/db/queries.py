@@ -1,7 +1,77 @@
-from source.db.db import async_session
+import contextlib
+import typing
+import zlib
+
+import sqlalchemy as sa
+from sqlalchemy.dialects.postgresql import ARRAY, insert
+
+from source.core.settings import settings
+from source.db.db import async_session, async_engine
 
 
 class BaseQueries:
+    conflict_target = ['id']
+
+    @staticmethod
+    def any_of(column, values) -> sa.ColumnElement:
+        """column = ANY(:values), the whole list is bound as one array parameter."""
+        return column == sa.any_(sa.bindparam(None, list(values), type_=ARRAY(column.type)))
+
+    @staticmethod
+    @contextlib.asynccontextmanager
+    async def transaction(session=None) -> typing.AsyncIterator:
+        """New session committed on a clean exit; a session= of the caller is only yielded, the caller commits it."""
+        if session is not None:
+            yield session
+            return
+        async with async_session() as session:
+            yield session
+            await session.commit()
+
+    @staticmethod
+    @contextlib.asynccontextmanager
+    async def advisory_lock(name: str) -> typing.AsyncIterator[bool]:
+        """Session-level pg_try_advisory_lock held for the block, yields whether it was taken."""
+        key = zlib.crc32(name.encode())
+        async with async_engine.connect() as connection:
+            acquired = (await connection.execute(sa.select(sa.func.pg_try_advisory_lock(key)))).scalar()
+            try:
+                yield acquired
+            finally:
+                if acquired:
+                    await connection.execute(sa.select(sa.func.pg_advisory_unlock(key)))
+
+    async def stream_all(
+            self, *criteria, columns: list = None, chunk_size: int = None) -> typing.AsyncIterator[list]:
+        """Rows matching criteria in chunks paginated by primary key, every chunk read in its own short session."""
+        chunk_size = chunk_size or settings.DB_STREAM_CHUNK_SIZE
+        key = getattr(self.model, self.model.__table__.primary_key.columns.values()[0].key)
+        if columns:
+            columns = list(columns) if any(column is key for column in columns) else [*columns, key]
+            statement = sa.select(*columns)
+        else:
+            statement = sa.select(self.model)
+        statement = statement.where(*criteria).order_by(key).limit(chunk_size)
+
+        last_key = None
+        while True:
+            async with async_session() as session:
+                result = await session.execute(
+                    statement if last_key is None else statement.where(key > last_key))
+                chunk = result.all() if columns else result.scalars().all()
+            if not chunk:
+                return
+            yield chunk
+            if len(chunk) < chunk_size:
+                return
+            last_key = getattr(chunk[-1], key.key)
+
+    async def count(self, *criteria) -> int:
+        async with async_session() as session:
+            result = await session.execute(
+                sa.select(sa.func.count()).select_from(self.model).where(*criteria)
+            )
+            return result.scalar()
 
     @staticmethod
     async def save_in_db(instances, many=False):
@@ -17,3 +87,85 @@ class BaseQueries:
         async with async_session() as session:
             await session.delete(instance)
             await session.commit()
+
+    async def delete_by_ids(self, ids: list[int], chunk_size: int = None, session=None) -> int:
+        """DELETE ... WHERE id = ANY(:ids) in one transaction, chunk_size ids per statement."""
+        chunk_size = chunk_size or settings.DB_BULK_CHUNK_SIZE
+        deleted = 0
+        async with self.transaction(session) as session:
+            for start in range(0, len(ids), chunk_size):
+                result = await session.execute(
+                    sa.delete(self.model)
+                    .where(self.any_of(self.model.id, ids[start:start + chunk_size]))
+                    .execution_options(synchronize_session=False)
+                )
+                deleted += result.rowcount
+        return deleted
+
+    async def delete_instances(self, instances: list, session=None) -> int:
+        return await self.delete_by_ids(
+            ids=[instance.id for instance in instances if instance.id is not None], session=session)
+
+    def as_rows(self, instances: list, primary_key: bool = True) -> list[dict]:
+        """Column values of ORM instances, unset primary keys are left out so the sequence fills them."""
+        attributes = sa.inspect(self.model).column_attrs
+        primary_keys = set(self.model.__table__.primary_key.columns.keys())
+        rows = []
+        for instance in instances:
+            row = {attribute.key: getattr(instance, attribute.key) for attribute in attributes}
+            for key in primary_keys:
+                if not primary_key or row.get(key) is None:
+                    row.pop(key, None)
+            rows.append(row)
+        return rows
+
+    async def bulk_upsert(
+            self, rows: list[dict], index_elements: list[str], update_columns: list[str] = None,
+            chunk_size: int = None, session=None) -> int:
+        """INSERT ... ON CONFLICT (index_elements) DO UPDATE, rows repeating a key are collapsed to the last one."""
+        rows = list({tuple(row[key] for key in index_elements): row for row in rows}.values())
+        if not rows:
+            return 0
+        chunk_size = chunk_size or settings.DB_BULK_CHUNK_SIZE
+        update_columns = update_columns or [key for key in rows[0] if key not in index_elements]
+        statement = insert(self.model)
+        statement = statement.on_conflict_do_update(
+            index_elements=index_elements,
+            set_={column: statement.excluded[column] for column in update_columns}
+        ).returning(*[getattr(self.model, column) for column in index_elements])
+
+        affected = 0
+        async with self.transaction(session) as session:
+            for start in range(0, len(rows), chunk_size):
+                result = await session.execute(statement, rows[start:start + chunk_size])
+                affected += len(result.all())
+        return affected
+
+    async def bulk_insert(self, instances: list, session=None) -> int:
+        """Append-only rows through asyncpg COPY, returns the number of copied rows."""
+        rows = self.as_rows(instances)
+        if not rows:
+            return 0
+        columns = [column for column in self.model.__table__.columns.keys() if column in rows[0]]
+        async with self.transaction(session) as session:
+            connection = await session.connection()
+            # the asyncpg adapter only sends BEGIN with its first statement, a COPY issued first would autocommit
+            await connection.exec_driver_sql('SELECT 1')
+            raw_connection = await connection.get_raw_connection()
+            await raw_connection.driver_connection.copy_records_to_table(
+                self.model.__tablename__, records=[tuple(row[column] for column in columns) for row in rows],
+                columns=columns
+            )
+        return len(rows)
+
+    async def bulk_save(self, instances: list, update_columns: list[str] = None, session=None) -> int:
+        """Upserts on conflict_target, with the default id target the instances without an id are copied."""
+        if self.conflict_target != ['id']:
+            return await self.bulk_upsert(
+                rows=self.as_rows(instances, primary_key=False), index_elements=self.conflict_target,
+                update_columns=update_columns, session=session)
+        existing = [instance for instance in instances if instance.id is not None]
+        new = [instance for instance in instances if instance.id is None]
+        saved = await self.bulk_upsert(
+            rows=self.as_rows(existing), index_elements=['id'], update_columns=update_columns, session=session)
+        return saved + await self.bulk_insert(instances=new, session=session)
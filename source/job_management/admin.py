@@ -0,0 +1,8 @@
+from sqladmin import ModelView
+from source.job_management.models import Job
+
+
+class JobAdmin(ModelView, model=Job):
+    column_list = ['id', 'name', 'status', 'progress_done', 'progress_total', 'created_at', 'finished_at']
+    column_searchable_list = ['name', 'status']
+    column_default_sort = [(Job.id, True)]
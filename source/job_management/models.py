@@ -0,0 +1,46 @@
+import sqlalchemy as sa
+
+from source.db.db import Base
+
+
+class Job(Base):
+    __tablename__ = 'jobs'
+
+    id = sa.Column(sa.Integer, primary_key=True)
+    name = sa.Column(sa.String, index=True)
+    status = sa.Column(sa.String, index=True)
+    payload = sa.Column(sa.JSON)
+    owner = sa.Column(sa.String)
+
+    progress_done = sa.Column(sa.Integer, default=0)
+    progress_total = sa.Column(sa.Integer)
+    error = sa.Column(sa.Text)
+
+    created_at = sa.Column(sa.DateTime)
+    started_at = sa.Column(sa.DateTime)
+    finished_at = sa.Column(sa.DateTime)
+
+    def __str__(self):
+        return f'{self.name} #{self.id}'
+
+    def __repr__(self):
+        return f'{self.name} #{self.id}'
+
+
+class ShardLease(Base):
+    __tablename__ = 'shard_leases'
+
+    job_name = sa.Column(sa.String, primary_key=True)
+    shard = sa.Column(sa.Integer, primary_key=True, autoincrement=False)
+    owner = sa.Column(sa.String)
+
+    requested_at = sa.Column(sa.DateTime)
+    claimed_at = sa.Column(sa.DateTime)
+    leased_until = sa.Column(sa.DateTime)
+    finished_at = sa.Column(sa.DateTime)
+
+    def __str__(self):
+        return f'{self.job_name} shard {self.shard}'
+
+    def __repr__(self):
+        return f'{self.job_name} shard {self.shard}'
@@ -0,0 +1,126 @@
+import datetime
+
+import sqlalchemy as sa
+from sqlalchemy.dialects.postgresql import insert
+
+from source.db.db import async_session
+from source.db.queries import BaseQueries
+from source.job_management.models import Job, ShardLease
+
+
+class JobQueries(BaseQueries):
+    model = Job
+
+    async def create_job(self, name: str, payload: dict, owner: str) -> Job:
+        job = self.model(
+            name=name, status='queued', payload=payload, owner=owner,
+            progress_done=0, created_at=datetime.datetime.now()
+        )
+        async with async_session() as session:
+            session.add(job)
+            await session.commit()
+            await session.refresh(job)
+        return job
+
+    async def get_job_by_id(self, job_id: int) -> Job | None:
+        async with async_session() as session:
+            result = await session.execute(
+                sa.select(self.model).where(self.model.id == job_id)
+            )
+            return result.scalars().first()
+
+    async def update_job(self, job_id: int, **values) -> None:
+        async with async_session() as session:
+            await session.execute(
+                sa.update(self.model).where(self.model.id == job_id).values(**values)
+            )
+            await session.commit()
+
+    async def advance_progress(self, job_id: int, count: int) -> None:
+        await self.update_job(job_id=job_id, progress_done=self.model.progress_done + count)
+
+    async def get_unfinished_owners(self) -> set[str]:
+        async with async_session() as session:
+            result = await session.execute(
+                sa.select(self.model.owner).distinct().where(self.model.status.in_(['queued', 'running']))
+            )
+            return set(result.scalars().all())
+
+    async def fail_unfinished(self, owners: list[str], error: str) -> int:
+        """Marks queued and running jobs of owners, processes that are gone, as failed."""
+        async with async_session() as session:
+            result = await session.execute(
+                sa.update(self.model)
+                .where(self.model.owner.in_(owners), self.model.status.in_(['queued', 'running']))
+                .values(status='failed', error=error, finished_at=datetime.datetime.now())
+            )
+            await session.commit()
+            return result.rowcount
+
+    async def delete_finished(self, before: datetime.datetime) -> int:
+        async with async_session() as session:
+            result = await session.execute(
+                sa.delete(self.model)
+                .where(self.model.status.in_(['done', 'skipped', 'failed']), self.model.finished_at < before)
+            )
+            await session.commit()
+            return result.rowcount
+
+
+class ShardLeaseQueries(BaseQueries):
+    """Shards are handed out with FOR UPDATE SKIP LOCKED, an expired lease makes its shard claimable again."""
+    model = ShardLease
+    conflict_target = ['job_name', 'shard']
+
+    async def request_sweep(self, job_name: str, shard_count: int) -> None:
+        now = datetime.datetime.now()
+        statement = insert(self.model).values(
+            [{'job_name': job_name, 'shard': shard, 'requested_at': now} for shard in range(shard_count)])
+        async with async_session() as session:
+            await session.execute(statement.on_conflict_do_update(
+                index_elements=self.conflict_target, set_={'requested_at': statement.excluded.requested_at}))
+            await session.commit()
+
+    async def claim_shard(self, job_name: str, shard_count: int, owner: str, ttl: int) -> int | None:
+        now = datetime.datetime.now()
+        async with async_session() as session:
+            result = await session.execute(
+                sa.select(self.model)
+                .where(self.model.job_name == job_name, self.model.shard < shard_count)
+                .where(self.model.requested_at > sa.func.coalesce(self.model.finished_at, datetime.datetime.min))
+                .where(sa.or_(self.model.leased_until.is_(None), self.model.leased_until < now))
+                .order_by(self.model.requested_at, self.model.shard)
+                .limit(1)
+                .with_for_update(skip_locked=True)
+            )
+            lease = result.scalars().first()
+            if not lease:
+                return None
+            lease.owner = owner
+            lease.claimed_at = now
+            lease.leased_until = now + datetime.timedelta(seconds=ttl)
+            await session.commit()
+            return lease.shard
+
+    async def renew_lease(self, job_name: str, shard: int, owner: str, ttl: int) -> bool:
+        async with async_session() as session:
+            result = await session.execute(
+                sa.update(self.model)
+                .where(self.model.job_name == job_name, self.model.shard == shard, self.model.owner == owner)
+                .values(leased_until=datetime.datetime.now() + datetime.timedelta(seconds=ttl))
+            )
+            await session.commit()
+            return bool(result.rowcount)
+
+    async def release_shard(self, job_name: str, shard: int, owner: str, finished: bool) -> None:
+        """Gives the shard back, a finished one counts as done for every sweep requested before it was claimed."""
+        values = {'leased_until': None}
+        if finished:
+            values['finished_at'] = self.model.claimed_at
+        async with async_session() as session:
+            await session.execute(
+                sa.update(self.model)
+                .where(self.model.job_name == job_name, self.model.shard == shard, self.model.owner == owner)
+                .values(**values)
+            )
+            await session.commit()
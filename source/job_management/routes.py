@@ -0,0 +1,42 @@
+from fastapi import APIRouter, HTTPException
+
+from source.job_management.queries import JobQueries
+from source.job_management.runner import job_runner
+
+router = APIRouter(prefix='/jobs', tags=['Jobs'])
+
+job_queries = JobQueries()
+
+
+@router.get('/{job_id}/')
+async def get_job(job_id: int):
+    job = await job_queries.get_job_by_id(job_id=job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail='Job not found')
+    return job_as_dict(job=job)
+
+
+@router.post('/{job_id}/retry/')
+async def retry_job(job_id: int):
+    job = await job_queries.get_job_by_id(job_id=job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail='Job not found')
+    try:
+        retried_job = await job_runner.retry(job=job)
+    except ValueError as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return {'job_id': retried_job.id}
+
+
+def job_as_dict(job) -> dict:
+    return {
+        'id': job.id,
+        'name': job.name,
+        'status': job.status,
+        'progress_done': job.progress_done,
+        'progress_total': job.progress_total,
+        'error': job.error,
+        'created_at': job.created_at,
+        'started_at': job.started_at,
+        'finished_at': job.finished_at,
+    }
@@ -0,0 +1,170 @@
+import asyncio
+import contextlib
+import dataclasses
+import datetime
+import os
+import socket
+import traceback
+import typing
+
+from source.core.settings import settings
+from source.db.queries import BaseQueries
+from source.job_management.models import Job
+from source.job_management.queries import JobQueries
+
+
+class JobProgress:
+    """Progress counters and non-fatal errors of a running job, without job_id it only counts in memory."""
+
+    def __init__(self, job_id: int = None, job_queries: JobQueries = None):
+        self.job_id = job_id
+        self.job_queries = job_queries
+        self.done = 0
+        self.total = None
+        self.errors: list[str] = []
+
+    async def set_total(self, total: int) -> None:
+        self.total = total
+        if self.job_id is not None:
+            await self.job_queries.update_job(job_id=self.job_id, progress_total=total)
+
+    async def advance(self, count: int = 1) -> None:
+        self.done += count
+        if self.job_id is not None and count:
+            await self.job_queries.advance_progress(job_id=self.job_id, count=count)
+
+    def add_error(self, error: str) -> None:
+        self.errors.append(error)
+
+
+@dataclasses.dataclass
+class JobHandler:
+    name: str
+    func: typing.Callable[..., typing.Awaitable]
+    single_flight: bool = True
+    resumable: bool = False
+    long_running: bool = False
+
+
+class JobRunner:
+    """Jobs persisted in the jobs table, long_running ones get their own JOB_LONG_WORKERS pool."""
+
+    max_error_length = 4000
+
+    def __init__(self):
+        self.handlers: dict[str, JobHandler] = {}
+        self.active: dict[str, int] = {}
+        self.queue: asyncio.Queue[Job] = asyncio.Queue()
+        self.long_queue: asyncio.Queue[Job] = asyncio.Queue()
+        self.job_queries = JobQueries()
+        self._workers: list[asyncio.Task] = []
+
+    def register(
+            self, name: str, func: typing.Callable[..., typing.Awaitable],
+            single_flight: bool = True, resumable: bool = False, long_running: bool = False) -> None:
+        self.handlers[name] = JobHandler(
+            name=name, func=func, single_flight=single_flight, resumable=resumable, long_running=long_running)
+
+    async def enqueue(self, name: str, **payload) -> Job:
+        handler = self.handlers[name]
+        if handler.single_flight and name in self.active:
+            job = await self.job_queries.get_job_by_id(job_id=self.active[name])
+            if job:
+                return job
+        job = await self.job_queries.create_job(name=name, payload=payload, owner=self.owner)
+        if handler.single_flight:
+            self.active[name] = job.id
+        (self.long_queue if handler.long_running else self.queue).put_nowait(job)
+        return job
+
+    async def retry(self, job: Job) -> Job:
+        if job.status not in ['failed', 'skipped']:
+            raise ValueError(f'Job {job.id} is {job.status}, only failed and skipped jobs can be retried')
+        payload = dict(job.payload or {})
+        if self.handlers[job.name].resumable:
+            payload['resume_from'] = job.progress_done or 0
+        return await self.enqueue(job.name, **payload)
+
+    async def run(self, job: Job) -> None:
+        handler = self.handlers[job.name]
+        lock = BaseQueries.advisory_lock(name=f'job:{job.name}') \
+            if handler.single_flight else contextlib.nullcontext(True)
+        try:
+            async with lock as acquired:
+                if not acquired:
+                    await self.job_queries.update_job(
+                        job_id=job.id, status='skipped', finished_at=datetime.datetime.now())
+                    return
+                await self.job_queries.update_job(
+                    job_id=job.id, status='running', started_at=datetime.datetime.now())
+                progress = JobProgress(job_id=job.id, job_queries=self.job_queries)
+                try:
+                    await handler.func(progress=progress, **(job.payload or {}))
+                except Exception as e:
+                    traceback.print_exc()
+                    error = f'{type(e).__name__}: {e}\n{traceback.format_exc()}'
+                    await self.job_queries.update_job(
+                        job_id=job.id, status='failed', error=error[-self.max_error_length:],
+                        finished_at=datetime.datetime.now())
+                else:
+                    error = '\n'.join(progress.errors) or None
+                    await self.job_queries.update_job(
+                        job_id=job.id, status='done', error=error and error[-self.max_error_length:],
+                        finished_at=datetime.datetime.now())
+        finally:
+            if self.active.get(job.name) == job.id:
+                del self.active[job.name]
+
+    async def _worker(self, queue: asyncio.Queue) -> None:
+        while True:
+            job = await queue.get()
+            try:
+                await self.run(job)
+            except Exception:
+                traceback.print_exc()
+            finally:
+                queue.task_done()
+
+    @property
+    def owner(self) -> str:
+        """hostname:pid, read at call time so a forked process does not inherit its parent's."""
+        return f'{socket.gethostname()}:{os.getpid()}'
+
+    def owner_gone(self, owner: str) -> bool:
+        """Whether owner (hostname:pid) is a process of this host that no longer runs, other hosts are left alone."""
+        host, _, pid = (owner or '').partition(':')
+        if host != socket.gethostname():
+            return False
+        if owner == self.owner or not pid.isdigit():
+            return True
+        try:
+            os.kill(int(pid), 0)
+        except ProcessLookupError:
+            return True
+        except PermissionError:
+            return False
+        return False
+
+    async def prune_finished(self, progress: JobProgress = None) -> None:
+        progress = progress or JobProgress()
+        deleted = await self.job_queries.delete_finished(
+            before=datetime.datetime.now() - datetime.timedelta(days=settings.JOB_RETENTION_DAYS))
+        await progress.advance(deleted)
+
+    async def start(self, workers: int = None, long_workers: int = None) -> None:
+        owners = [owner for owner in await self.job_queries.get_unfinished_owners() if self.owner_gone(owner)]
+        if owners:
+            await self.job_queries.fail_unfinished(owners=owners, error='Interrupted by a restart')
+        for _ in range(workers or settings.JOB_WORKERS):
+            self._workers.append(asyncio.ensure_future(self._worker(queue=self.queue)))
+        for _ in range(long_workers or settings.JOB_LONG_WORKERS):
+            self._workers.append(asyncio.ensure_future(self._worker(queue=self.long_queue)))
+
+    async def stop(self) -> None:
+        for task in self._workers:
+            task.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers.clear()
+
+
+job_runner = JobRunner()
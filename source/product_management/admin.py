@@ -1,5 +1,5 @@
 from sqladmin import ModelView
-from source.product_management.models import Product, ProductHistory, Characteristic, Shop, Order
+from source.product_management.models import Product, ProductHistory, Characteristic, Shop, Order, OutboxEvent
 
 
 class ShopAdmin(ModelView, model=Shop):
@@ -29,3 +29,9 @@ class ProductHistoryAdmin(ModelView, model=ProductHistory):
 class OrderAdmin(ModelView, model=Order):
     column_list = ['orderUid', 'nm_id']
     column_searchable_list = ['orderUid', 'nm_id']
+
+
+class OutboxEventAdmin(ModelView, model=OutboxEvent):
+    column_list = ['id', 'destination', 'attempts', 'next_attempt_at', 'last_error']
+    column_searchable_list = ['idempotency_key']
+    column_default_sort = [(OutboxEvent.id, False)]
@@ -0,0 +1,248 @@
+import datetime
+import typing
+
+import pandas as pd
+
+from source.product_management.models import Product, Characteristic, ProductHistory, EventType
+from source.product_management.records import ParsedProduct, ParsedCharacteristic
+from source.product_management.utils import ProductUtils
+
+
+class ChangeDetector:
+    """Compares saved and parsed products keyed by nm_id, characteristics keyed by (nm_id, name)."""
+
+    content_fields = ['vendor_code', 'brand', 'subj_name', 'imt_name', 'name', 'description_hash']
+    detail_fields = ['brand', 'name']
+    price_fields = ['priceU', 'salePriceU', 'clientSale', 'basicSale']
+    # columns each tier writes back, the tiers run concurrently and must not overwrite each other's fields
+    content_update_columns = [
+        'vendor_code', 'brand', 'subj_name', 'imt_name', 'name', 'description',
+        'description_hash', 'characteristics_hash', 'updated_at'
+    ]
+    price_update_columns = price_fields + ['updated_at']
+
+    @staticmethod
+    def fields_differ(saved: typing.Any, parsed: ParsedProduct, fields: list[str]) -> bool:
+        return any(getattr(saved, field) != getattr(parsed, field) for field in fields)
+
+    @staticmethod
+    def characteristics_changed(saved: typing.Any, parsed: ParsedProduct) -> bool:
+        return saved.characteristics_hash is None or saved.characteristics_hash != parsed.characteristics_hash
+
+    def select_changed(
+            self, snapshots: dict[int, typing.Any], parsed_products: list[ParsedProduct],
+            unchanged_cards: set[int] = frozenset()) -> tuple[set[int], set[int]]:
+        """nm ids whose parsed product differs from its snapshot, and the subset whose characteristics differ."""
+        changed = set()
+        characteristics_changed = set()
+        for parsed_product in parsed_products:
+            snapshot = snapshots.get(parsed_product.nm_id)
+            if snapshot is None:
+                continue
+            if parsed_product.nm_id in unchanged_cards:
+                if self.fields_differ(saved=snapshot, parsed=parsed_product, fields=self.detail_fields):
+                    changed.add(parsed_product.nm_id)
+            elif self.characteristics_changed(saved=snapshot, parsed=parsed_product):
+                changed.add(parsed_product.nm_id)
+                characteristics_changed.add(parsed_product.nm_id)
+            elif self.fields_differ(saved=snapshot, parsed=parsed_product, fields=self.content_fields):
+                changed.add(parsed_product.nm_id)
+        return changed, characteristics_changed
+
+    def select_changed_prices(
+            self, snapshots: dict[int, typing.Any], parsed_products: list[ParsedProduct]) -> set[int]:
+        return {
+            parsed_product.nm_id for parsed_product in parsed_products
+            if parsed_product.nm_id in snapshots
+            and self.fields_differ(saved=snapshots[parsed_product.nm_id], parsed=parsed_product, fields=self.price_fields)
+        }
+
+    @staticmethod
+    def group_characteristics(characteristics: list[Characteristic]) -> dict[int, list[Characteristic]]:
+        characteristics_dict = dict()
+        for characteristic in characteristics:
+            if characteristics_dict.get(characteristic.product_nm_id):
+                characteristics_dict[characteristic.product_nm_id].append(characteristic)
+            else:
+                characteristics_dict[characteristic.product_nm_id] = [characteristic]
+        return characteristics_dict
+
+    async def detect_changes(
+            self, saved_products: list[Product], saved_characteristics: list[Characteristic],
+            parsed_products: list[ParsedProduct], parsed_characteristics: list[ParsedCharacteristic],
+            unchanged_cards: set[int] = frozenset()) -> tuple[list, list, list, list]:
+        """unchanged_cards are nm ids whose card.json did not change, their card fields and characteristics are not diffed."""
+        saved_products_dict = {product.nm_id: product for product in saved_products}
+        diffed_nm_ids = {product.nm_id for product in parsed_products
+                         if product.nm_id in saved_products_dict and product.nm_id not in unchanged_cards
+                         and self.characteristics_changed(saved=saved_products_dict[product.nm_id], parsed=product)}
+
+        characteristics_to_be_saved, characteristics_to_be_deleted, char_histories = \
+            await self.detect_change_in_characteristics(
+                saved_characteristics=[characteristic for characteristic in saved_characteristics
+                                       if characteristic.product_nm_id in diffed_nm_ids],
+                parsed_characteristics=[characteristic for characteristic in parsed_characteristics
+                                        if characteristic.product_nm_id in diffed_nm_ids],
+                products=saved_products_dict,
+            )
+
+        products_to_be_saved = []
+        product_history_to_be_saved = []
+        for parsed_product in parsed_products:
+            saved_product = saved_products_dict.get(parsed_product.nm_id)
+            if saved_product is None:
+                continue
+
+            if saved_product.nm_id in unchanged_cards:
+                ProductUtils.copy_card_fields(source=saved_product, target=parsed_product)
+
+            product_to_be_saved, product_history_list = await self.detect_change_in_content(
+                saved_product=saved_product, parsed_product=parsed_product)
+            hashes_changed = self.fields_differ(
+                saved=saved_product, parsed=parsed_product, fields=['description_hash', 'characteristics_hash'])
+            saved_product.description_hash = parsed_product.description_hash
+            saved_product.characteristics_hash = parsed_product.characteristics_hash
+            if product_to_be_saved or hashes_changed:
+                products_to_be_saved.append(saved_product)
+
+            product_history_to_be_saved += product_history_list + char_histories.pop(saved_product.nm_id, [])
+
+        return products_to_be_saved, characteristics_to_be_saved, characteristics_to_be_deleted, product_history_to_be_saved
+
+    @classmethod
+    async def detect_change_in_content(
+            cls, saved_product: Product, parsed_product: ParsedProduct) -> tuple[Product | None, list[ProductHistory]]:
+        """Slow tier: fields that come from card.json plus the name and brand."""
+        actions = []
+        if saved_product.vendor_code != parsed_product.vendor_code:
+            actions.append((EventType.VENDOR_CODE_CHANGE, f'Замечено изменение вендор кода товара \n с {saved_product.vendor_code} на {parsed_product.vendor_code}'))
+            saved_product.vendor_code = parsed_product.vendor_code
+
+        if saved_product.brand != parsed_product.brand:
+            actions.append((EventType.BRAND_CHANGE, f'Замечено изменение бренда товара \n с "{saved_product.brand}" на "{parsed_product.brand}"'))
+            saved_product.brand = parsed_product.brand
+
+        if saved_product.subj_name != parsed_product.subj_name:
+            actions.append((EventType.SUBJECT_CHANGE, f'Замечено изменение подкатегории товара \n с "{saved_product.subj_name}" на "{parsed_product.subj_name}"'))
+            saved_product.subj_name = parsed_product.subj_name
+
+        if saved_product.imt_name != parsed_product.imt_name:
+            actions.append((EventType.IMT_NAME_CHANGE, f'Замечено изменение imt_name товара \n с "{saved_product.imt_name}" на "{parsed_product.imt_name}"'))
+            saved_product.imt_name = parsed_product.imt_name
+
+        if saved_product.name != parsed_product.name:
+            actions.append((EventType.NAME_CHANGE, f'Замечено изменение в наименовании товара \n с "{saved_product.name}" на "{parsed_product.name}"'))
+            saved_product.name = parsed_product.name
+
+        if saved_product.description != parsed_product.description:
+            actions.append((EventType.DESCRIPTION_CHANGE, f'Замечено изменение в описании товара \n с "{saved_product.description}" на "{parsed_product.description}"'))
+            saved_product.description = parsed_product.description
+
+        return cls.make_product_histories(saved_product=saved_product, actions=actions)
+
+    @classmethod
+    async def detect_change_in_prices(
+            cls, saved_product: Product, parsed_product: ParsedProduct) -> tuple[Product | None, list[ProductHistory]]:
+        """Fast tier: price and discount fields, all of them come from the detail endpoint."""
+        actions = []
+        if saved_product.priceU != parsed_product.priceU:
+            actions.append((EventType.PRICE_CHANGE, f'Замечено изменение в цене товара до скидки\n с "{saved_product.priceU}" на "{parsed_product.priceU}"'))
+            saved_product.priceU = parsed_product.priceU
+
+        if saved_product.salePriceU != parsed_product.salePriceU:
+            actions.append((EventType.SALE_PRICE_CHANGE, f'Замечено изменение в цене товара после скидки\n с "{saved_product.salePriceU}" на "{parsed_product.salePriceU}"'))
+            saved_product.salePriceU = parsed_product.salePriceU
+
+        if saved_product.clientSale != parsed_product.clientSale:
+            actions.append((EventType.CLIENT_SALE_CHANGE, f'Замечено изменение скидки товара ССП\n с "{saved_product.clientSale}" на "{parsed_product.clientSale}"'))
+            saved_product.clientSale = parsed_product.clientSale
+
+        if saved_product.basicSale != parsed_product.basicSale:
+            actions.append((EventType.BASIC_SALE_CHANGE, f'Замечено изменение скидки покупателя товара \n с "{saved_product.basicSale}" на "{parsed_product.basicSale}"'))
+            saved_product.basicSale = parsed_product.basicSale
+
+        return cls.make_product_histories(saved_product=saved_product, actions=actions)
+
+    @staticmethod
+    def make_product_histories(
+            saved_product: Product, actions: list[tuple[str, str]]) -> tuple[Product | None, list[ProductHistory]]:
+        """actions are (event_type, action) pairs."""
+        if actions:
+            saved_product.updated_at = datetime.datetime.now()
+            return saved_product, [
+                ProductHistory(
+                    nm_id=saved_product.nm_id,
+                    action=action,
+                    event_type=event_type,
+                    created_at=datetime.datetime.now(),
+                    shop_id=saved_product.shop_id,
+                    shops_supplier=saved_product.shops_supplier,
+                )
+                for event_type, action in actions
+            ]
+        return None, []
+
+    @staticmethod
+    async def detect_change_in_characteristics(
+            saved_characteristics: list[Characteristic],
+            parsed_characteristics: list[ParsedCharacteristic],
+            products: dict[int, Product],
+    ) -> tuple[list[Characteristic], list[Characteristic], dict[int, list[ProductHistory]]]:
+        """One catalog-wide outer join of saved and parsed characteristics, only changed rows become objects."""
+        characteristics_to_be_saved = []
+        characteristics_to_be_deleted = []
+        histories = dict()
+        if not saved_characteristics and not parsed_characteristics:
+            return characteristics_to_be_saved, characteristics_to_be_deleted, histories
+
+        saved_df = pd.DataFrame({
+            'nm_id': [characteristic.product_nm_id for characteristic in saved_characteristics],
+            'name': [characteristic.name for characteristic in saved_characteristics],
+            'saved_value': [characteristic.value for characteristic in saved_characteristics],
+            'saved_index': range(len(saved_characteristics)),
+        }, columns=['nm_id', 'name', 'saved_value', 'saved_index']).astype({'nm_id': 'int64'})
+        saved_df = saved_df.drop_duplicates(subset=['nm_id', 'name'])
+        parsed_df = pd.DataFrame({
+            'nm_id': [characteristic.product_nm_id for characteristic in parsed_characteristics],
+            'name': [characteristic.name for characteristic in parsed_characteristics],
+            'parsed_value': [characteristic.value for characteristic in parsed_characteristics],
+            'parsed_index': range(len(parsed_characteristics)),
+        }, columns=['nm_id', 'name', 'parsed_value', 'parsed_index']).astype({'nm_id': 'int64'})
+        parsed_df = parsed_df.drop_duplicates(subset=['nm_id', 'name'])
+        df = pd.merge(saved_df, parsed_df, how='outer', on=['nm_id', 'name'], indicator=True)
+
+        both = df['_merge'] == 'both'
+        same_value = (df['saved_value'] == df['parsed_value']) | (df['saved_value'].isna() & df['parsed_value'].isna())
+        removed = df.loc[df['_merge'] == 'left_only', ['nm_id', 'saved_index']]
+        changed = df.loc[both & ~same_value, ['nm_id', 'saved_index', 'parsed_index']]
+        added = df.loc[df['_merge'] == 'right_only', ['nm_id', 'parsed_index']]
+
+        def add_history(nm_id: int, event_type: str, action: str) -> None:
+            product = products.get(nm_id)
+            histories.setdefault(nm_id, []).append(ProductHistory(
+                nm_id=nm_id,
+                action=action,
+                event_type=event_type,
+                created_at=datetime.datetime.now(),
+                shop_id=product.shop_id if product else None,
+                shops_supplier=product.shops_supplier if product else None
+            ))
+
+        for nm_id, saved_index in removed.itertuples(index=False):
+            saved_characteristic = saved_characteristics[int(saved_index)]
+            add_history(int(nm_id), EventType.CHAR_REMOVED, f'Удалена характеристика товара с названием {saved_characteristic.name} и со значением {saved_characteristic.value}')
+            characteristics_to_be_deleted.append(saved_characteristic)
+
+        for nm_id, saved_index, parsed_index in changed.itertuples(index=False):
+            saved_characteristic = saved_characteristics[int(saved_index)]
+            parsed_characteristic = parsed_characteristics[int(parsed_index)]
+            add_history(int(nm_id), EventType.CHAR_CHANGED, f'Поменялось значение характеристики {saved_characteristic.name} с {saved_characteristic.value} на {parsed_characteristic.value}')
+            saved_characteristic.value = parsed_characteristic.value
+            characteristics_to_be_saved.append(saved_characteristic)
+
+        for nm_id, parsed_index in added.itertuples(index=False):
+            parsed_characteristic = parsed_characteristics[int(parsed_index)]
+            add_history(int(nm_id), EventType.CHAR_ADDED, f'Добавлена новая характеристика товара с названием {parsed_characteristic.name} и со значением {parsed_characteristic.value}')
+            characteristics_to_be_saved.append(parsed_characteristic.to_model())
+
+        return characteristics_to_be_saved, characteristics_to_be_deleted, histories
@@ -0,0 +1,53 @@
+import os
+
+from source.core.scheduler import Scheduler
+from source.core.settings import settings
+from source.job_management.runner import JobProgress, JobRunner
+from source.product_management.services import ProductImportServices, ProductServices
+
+product_services = ProductServices()
+product_import_services = ProductImportServices()
+
+
+async def import_products_by_excel(progress: JobProgress, path: str, shop_id: int, resume_from: int = 0) -> None:
+    """Imports the uploaded file saved at path. The file is removed once imported and kept for a retry otherwise."""
+    await product_import_services.import_products_by_excel(
+        path=path, shop_id=shop_id, progress=progress, resume_from=resume_from)
+    os.remove(path)
+
+
+def register_jobs(scheduler: Scheduler, job_runner: JobRunner) -> None:
+    job_runner.register(name='price_monitoring', func=product_services.price_monitoring, long_running=True)
+    job_runner.register(
+        name='product_monitoring', func=product_services.sharded_product_monitoring, long_running=True)
+    job_runner.register(name='order_monitoring', func=product_services.order_monitoring)
+    job_runner.register(name='order_status_monitoring', func=product_services.order_status_monitoring)
+    job_runner.register(
+        name='history_partition_maintenance', func=product_services.maintain_history_partitions, long_running=True)
+    job_runner.register(name='advertisement_outbox_dispatch', func=product_services.dispatch_outbox)
+    job_runner.register(name='job_cleanup', func=job_runner.prune_finished)
+    job_runner.register(
+        name='import_products_by_excel', func=import_products_by_excel, single_flight=False, resumable=True,
+        long_running=True)
+
+    scheduler.add_job(
+        name='price_monitoring',
+        interval=settings.PRICE_MONITORING_INTERVAL, jitter=settings.SCHEDULER_JITTER)
+    scheduler.add_job(
+        name='product_monitoring',
+        interval=settings.PRODUCT_MONITORING_INTERVAL, jitter=settings.SCHEDULER_JITTER)
+    scheduler.add_job(
+        name='order_monitoring',
+        interval=settings.ORDER_MONITORING_INTERVAL, jitter=settings.SCHEDULER_JITTER)
+    scheduler.add_job(
+        name='order_status_monitoring',
+        interval=settings.ORDER_STATUS_MONITORING_INTERVAL, jitter=settings.SCHEDULER_JITTER)
+    scheduler.add_job(
+        name='history_partition_maintenance',
+        interval=settings.HISTORY_PARTITION_MAINTENANCE_INTERVAL, jitter=settings.SCHEDULER_JITTER)
+    scheduler.add_job(
+        name='job_cleanup',
+        interval=settings.JOB_CLEANUP_INTERVAL, jitter=settings.SCHEDULER_JITTER)
+    scheduler.add_job(
+        name='advertisement_outbox_dispatch',
+        interval=settings.OUTBOX_DISPATCH_INTERVAL, jitter=settings.SCHEDULER_JITTER)
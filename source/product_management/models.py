@@ -32,7 +32,7 @@ class Product(Base):
     __tablename__ = 'products'
 
     id = sa.Column(sa.Integer, primary_key=True)
-    nm_id = sa.Column(sa.BIGINT)
+    nm_id = sa.Column(sa.BIGINT, unique=True, index=True)
     vendor_code = sa.Column(sa.String)
     brand = sa.Column(sa.String)
     subj_name = sa.Column(sa.String)
@@ -40,6 +40,8 @@ class Product(Base):
     imt_name = sa.Column(sa.String)
     name = sa.Column(sa.String)
     description = sa.Column(sa.String)
+    description_hash = sa.Column(sa.String)
+    characteristics_hash = sa.Column(sa.String)
 
     priceU = sa.Column(sa.Integer)
     salePriceU = sa.Column(sa.Integer)
@@ -48,7 +50,7 @@ class Product(Base):
     updated_at = sa.Column(sa.DateTime)
 
     shops_supplier = sa.Column(sa.String)
-    shop_id = sa.Column(sa.Integer, sa.ForeignKey('shops.id'))
+    shop_id = sa.Column(sa.Integer, sa.ForeignKey('shops.id'), index=True)
     shop = relationship('Shop', back_populates='products')
 
     def __str__(self):
@@ -60,6 +62,9 @@ class Product(Base):
 
 class Characteristic(Base):
     __tablename__ = 'characteristics'
+    __table_args__ = (
+        sa.UniqueConstraint('product_nm_id', 'name', name='uq_characteristics_product_nm_id_name'),
+    )
 
     id = sa.Column(sa.Integer, primary_key=True)
     name = sa.Column(sa.String)
@@ -74,19 +79,52 @@ class Characteristic(Base):
         return self.name
 
 
+class EventType:
+    VENDOR_CODE_CHANGE = 'vendor_code_change'
+    BRAND_CHANGE = 'brand_change'
+    SUBJECT_CHANGE = 'subject_change'
+    IMT_NAME_CHANGE = 'imt_name_change'
+    NAME_CHANGE = 'name_change'
+    DESCRIPTION_CHANGE = 'description_change'
+
+    PRICE_CHANGE = 'price_change'
+    SALE_PRICE_CHANGE = 'sale_price_change'
+    CLIENT_SALE_CHANGE = 'client_sale_change'
+    BASIC_SALE_CHANGE = 'basic_sale_change'
+
+    CHAR_ADDED = 'char_added'
+    CHAR_REMOVED = 'char_removed'
+    CHAR_CHANGED = 'char_changed'
+
+    ORDER_NEW = 'order_new'
+    ORDER = 'order'
+    SALE = 'sale'
+    RETURN = 'return'
+    CANCEL = 'cancel'
+    STATUS_CHANGE = 'status_change'
+
+    OTHER = 'other'
+
+
 class ProductHistory(Base):
+    """Range partitioned by month of created_at, see ProductHistoryQueries for the partition maintenance."""
     __tablename__ = 'product_histories'
+    __table_args__ = {'postgresql_partition_by': 'RANGE (created_at)', 'info': {'partitioned': True}}
 
-    id = sa.Column(sa.Integer, primary_key=True)
-    nm_id = sa.Column(sa.BIGINT)
+    id = sa.Column(sa.Integer, primary_key=True, autoincrement=True)
+    nm_id = sa.Column(sa.BIGINT, index=True)
     action = sa.Column(sa.String)
-    created_at = sa.Column(sa.DateTime)
+    event_type = sa.Column(sa.String)
+    created_at = sa.Column(sa.DateTime, primary_key=True, index=True)
     price_for_sale = sa.Column(sa.Integer)
 
     shops_supplier = sa.Column(sa.String)
     shop_id = sa.Column(sa.Integer, sa.ForeignKey('shops.id'))
     shop = relationship('Shop', back_populates='history')
 
+    # ids come from one sequence, so the ORM (and sqladmin, which needs a single key) identifies rows by id alone
+    __mapper_args__ = {'primary_key': [id]}
+
     def __str__(self):
         return str(self.nm_id)
 
@@ -94,8 +132,53 @@ class ProductHistory(Base):
         return str(self.nm_id)
 
 
+class ProductEventRollup(Base):
+    """Daily number of history events per shop, nm_id and event type, 0 stands for an unknown shop or nm_id."""
+    __tablename__ = 'product_event_rollups'
+    __table_args__ = (
+        sa.Index('ix_product_event_rollups_nm_id_day', 'nm_id', 'day'),
+        sa.Index('ix_product_event_rollups_shop_id_day', 'shop_id', 'day'),
+    )
+
+    day = sa.Column(sa.Date, primary_key=True)
+    shop_id = sa.Column(sa.Integer, primary_key=True, autoincrement=False)
+    nm_id = sa.Column(sa.BIGINT, primary_key=True, autoincrement=False)
+    event_type = sa.Column(sa.String, primary_key=True)
+    events = sa.Column(sa.Integer, nullable=False)
+
+    def __str__(self):
+        return f'{self.nm_id} {self.event_type} {self.day}'
+
+    def __repr__(self):
+        return f'{self.nm_id} {self.event_type} {self.day}'
+
+
+class OutboxEvent(Base):
+    """An event waiting for delivery to another service, written in the transaction that produced it."""
+    __tablename__ = 'outbox_events'
+
+    id = sa.Column(sa.BIGINT, primary_key=True)
+    destination = sa.Column(sa.String, nullable=False)
+    idempotency_key = sa.Column(sa.String, nullable=False, unique=True)
+    payload = sa.Column(sa.JSON, nullable=False)
+    attempts = sa.Column(sa.Integer, nullable=False, default=0)
+    next_attempt_at = sa.Column(sa.DateTime, nullable=False, index=True)
+    last_error = sa.Column(sa.Text)
+    created_at = sa.Column(sa.DateTime, nullable=False)
+
+    def __str__(self):
+        return f'{self.destination} {self.idempotency_key}'
+
+    def __repr__(self):
+        return f'{self.destination} {self.idempotency_key}'
+
+
 class Order(Base):
     __tablename__ = 'orders'
+    __table_args__ = (
+        sa.UniqueConstraint('shop_id', 'orderUid', name='uq_orders_shop_id_orderUid'),
+        sa.Index('ix_orders_shop_id_status', 'shop_id', 'status'),
+    )
 
     id = sa.Column(sa.Integer, primary_key=True)
     orderUid = sa.Column(sa.String)
@@ -111,3 +194,50 @@ class Order(Base):
 
     def __repr__(self):
         return f'{self.nm_id} order'
+
+
+class CardCache(Base):
+    __tablename__ = 'card_caches'
+
+    nm_id = sa.Column(sa.BIGINT, primary_key=True, autoincrement=False)
+    etag = sa.Column(sa.String)
+    last_modified = sa.Column(sa.String)
+    content_hash = sa.Column(sa.String)
+    checked_at = sa.Column(sa.DateTime, index=True)
+
+    def __str__(self):
+        return str(self.nm_id)
+
+    def __repr__(self):
+        return str(self.nm_id)
+
+
+class CardCacheDailyStats(Base):
+    """Conditional card.json request counters of all processes, summed per day."""
+    __tablename__ = 'card_cache_daily_stats'
+
+    day = sa.Column(sa.Date, primary_key=True)
+    requests = sa.Column(sa.Integer, nullable=False)
+    not_modified = sa.Column(sa.Integer, nullable=False)
+    unchanged = sa.Column(sa.Integer, nullable=False)
+
+    def __str__(self):
+        return str(self.day)
+
+    def __repr__(self):
+        return str(self.day)
+
+
+class OrderCursor(Base):
+    __tablename__ = 'order_cursors'
+
+    shop_id = sa.Column(sa.Integer, sa.ForeignKey('shops.id'), primary_key=True)
+    endpoint = sa.Column(sa.String, primary_key=True)
+    last_change_date = sa.Column(sa.DateTime)
+    updated_at = sa.Column(sa.DateTime)
+
+    def __str__(self):
+        return f'{self.shop_id} {self.endpoint}'
+
+    def __repr__(self):
+        return f'{self.shop_id} {self.endpoint}'
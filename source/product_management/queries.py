@@ -1,6 +1,15 @@
+import asyncio
+import collections
+import datetime
+import gzip
+import hashlib
+import uuid
+
 from source.db.db import async_session
 import sqlalchemy as sa
-from source.product_management.models import Product, Characteristic, ProductHistory, Shop, Order
+from sqlalchemy.dialects.postgresql import insert
+from source.product_management.models import Product, Characteristic, ProductHistory, Shop, Order, CardCache, \
+    OrderCursor, ProductEventRollup, EventType, OutboxEvent, CardCacheDailyStats
 from source.db.queries import BaseQueries
 
 
@@ -25,6 +34,7 @@ class ShopQueries(BaseQueries):
 class ProductQueries(BaseQueries):
 
     model = Product
+    conflict_target = ['nm_id']
 
     async def fetch_all(self) -> list[Product]:
         async with async_session() as session:
@@ -40,9 +50,69 @@ class ProductQueries(BaseQueries):
             )
             return result.scalars().all()
 
+    async def get_saved_nm_ids(self, shop_id: int, nm_ids: list[int]) -> set[int]:
+        """The subset of nm_ids that the shop already has, only the given ids are looked up."""
+        async with async_session() as session:
+            result = await session.execute(
+                sa.select(self.model.nm_id)
+                .where(self.model.shop_id == shop_id)
+                .where(self.any_of(self.model.nm_id, nm_ids))
+            )
+            return set(result.scalars().all())
+
+    async def get_existing_nm_ids(self, nm_ids: list[int]) -> set[int]:
+        async with async_session() as session:
+            result = await session.execute(
+                sa.select(self.model.nm_id).where(self.any_of(self.model.nm_id, nm_ids))
+            )
+            return set(result.scalars().all())
+
+    # everything change detection compares, without the description text
+    snapshot_columns = [
+        Product.id, Product.nm_id, Product.vendor_code, Product.brand, Product.subj_name, Product.imt_name,
+        Product.name, Product.description_hash, Product.characteristics_hash,
+    ]
+    price_snapshot_columns = [
+        Product.id, Product.nm_id, Product.priceU, Product.salePriceU, Product.clientSale, Product.basicSale,
+    ]
+
+    async def get_by_nm_ids(self, nm_ids: list[int]) -> list[Product]:
+        if not nm_ids:
+            return []
+        async with async_session() as session:
+            result = await session.execute(
+                sa.select(self.model).where(self.any_of(self.model.nm_id, nm_ids))
+            )
+            return result.scalars().all()
+
+    export_columns = [
+        Product.id, Product.nm_id, Product.vendor_code, Product.brand, Product.subj_name, Product.subj_root_name,
+        Product.imt_name, Product.name, Product.description, Product.priceU, Product.salePriceU, Product.clientSale,
+        Product.basicSale, Product.shop_id, Product.shops_supplier, Product.updated_at,
+    ]
+
+    def export_criteria(
+            self, shop_id: int = None, date_from: datetime.datetime = None, date_to: datetime.datetime = None) -> list:
+        """Filters of the products export, the dates apply to updated_at."""
+        criteria = []
+        if shop_id is not None:
+            criteria.append(self.model.shop_id == shop_id)
+        if date_from is not None:
+            criteria.append(self.model.updated_at >= date_from)
+        if date_to is not None:
+            criteria.append(self.model.updated_at < date_to)
+        return criteria
+
+    def shard_criteria(self, shard: int = None, shard_count: int = None) -> list:
+        """Products whose nm_id % shard_count == shard, all of them without a shard."""
+        if shard is None:
+            return []
+        return [self.model.nm_id % shard_count == shard]
+
 
 class CharacteristicQueries(BaseQueries):
     model = Characteristic
+    conflict_target = ['product_nm_id', 'name']
 
     async def fetch_all(self) -> list[Characteristic]:
         async with async_session() as session:
@@ -51,13 +121,22 @@ class CharacteristicQueries(BaseQueries):
             )
             return result.scalars().all()
 
-    async def delete_instances(self, instances: list[Characteristic]) -> None:
-        for instance in instances:
-            await self.delete_instance(instance=instance)
+    async def get_by_product_nm_ids(self, nm_ids: list[int]) -> list[Characteristic]:
+        if not nm_ids:
+            return []
+        async with async_session() as session:
+            result = await session.execute(
+                sa.select(self.model).where(self.any_of(self.model.product_nm_id, nm_ids))
+            )
+            return result.scalars().all()
 
 
 class ProductHistoryQueries(BaseQueries):
     model = ProductHistory
+    export_columns = [
+        ProductHistory.id, ProductHistory.nm_id, ProductHistory.event_type, ProductHistory.action,
+        ProductHistory.price_for_sale, ProductHistory.shop_id, ProductHistory.shops_supplier, ProductHistory.created_at,
+    ]
 
     async def fetch_all(self) -> list[ProductHistory]:
         async with async_session() as session:
@@ -66,9 +145,223 @@ class ProductHistoryQueries(BaseQueries):
             )
             return result.scalars().all()
 
+    async def save_histories(
+            self, histories: list[ProductHistory], outbox_destination: str = None,
+            outbox_payloads: list[dict] = None, session=None) -> int:
+        """COPYs the histories with their daily rollups and outbox_payloads in one transaction."""
+        if not histories:
+            return 0
+        async with self.transaction(session) as session:
+            saved = await self.bulk_insert(instances=histories, session=session)
+            await ProductEventRollupQueries().add_events(histories=histories, session=session)
+            if outbox_payloads:
+                await OutboxEventQueries().add_events(
+                    destination=outbox_destination, payloads=outbox_payloads, session=session)
+        return saved
+
+    def export_criteria(
+            self, shop_id: int = None, date_from: datetime.datetime = None, date_to: datetime.datetime = None) -> list:
+        criteria = []
+        if shop_id is not None:
+            criteria.append(self.model.shop_id == shop_id)
+        if date_from is not None:
+            criteria.append(self.model.created_at >= date_from)
+        if date_to is not None:
+            criteria.append(self.model.created_at < date_to)
+        return criteria
+
+    # monthly partitions are named product_histories_p2026_10, rows of months without one go to the default partition
+    partition_prefix = 'product_histories_p'
+    default_partition = 'product_histories_default'
+
+    def partition_name(self, month: datetime.date) -> str:
+        return f'{self.partition_prefix}{month:%Y_%m}'
+
+    @staticmethod
+    def next_month(month: datetime.date) -> datetime.date:
+        return (month.replace(day=1) + datetime.timedelta(days=32)).replace(day=1)
+
+    async def get_partition_months(self) -> list[datetime.date]:
+        async with async_session() as session:
+            result = await session.execute(sa.text(
+                "SELECT child.relname FROM pg_inherits "
+                "JOIN pg_class child ON child.oid = pg_inherits.inhrelid "
+                "WHERE pg_inherits.inhparent = CAST(:table AS regclass)"
+            ), {'table': self.model.__tablename__})
+            names = result.scalars().all()
+        return sorted(
+            datetime.datetime.strptime(name[len(self.partition_prefix):], '%Y_%m').date()
+            for name in names if name.startswith(self.partition_prefix)
+        )
+
+    async def create_partition(self, month: datetime.date) -> None:
+        """Creates the month's partition, rows of that month already in the default partition are moved into it."""
+        name = self.partition_name(month=month)
+        bounds = {'start': month, 'end': self.next_month(month=month)}
+        table = self.model.__tablename__
+        async with async_session() as session:
+            await session.execute(sa.text(f'CREATE TABLE {name} (LIKE {table} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)'))
+            await session.execute(sa.text(
+                f'INSERT INTO {name} SELECT * FROM {self.default_partition} '
+                f'WHERE created_at >= :start AND created_at < :end'
+            ), bounds)
+            await session.execute(sa.text(
+                f'DELETE FROM {self.default_partition} WHERE created_at >= :start AND created_at < :end'
+            ), bounds)
+            await session.execute(sa.text(
+                f"ALTER TABLE {table} ATTACH PARTITION {name} FOR VALUES FROM ('{bounds['start']}') TO ('{bounds['end']}')"
+            ))
+            await session.commit()
+
+    async def archive_partition(self, month: datetime.date, path: str) -> None:
+        """Writes the month's partition to a gzipped csv file with asyncpg COPY."""
+        with gzip.open(path, 'wb') as archive:
+            async def write(data: bytes) -> None:
+                await asyncio.to_thread(archive.write, data)
+
+            async with async_session() as session:
+                connection = await session.connection()
+                raw_connection = await connection.get_raw_connection()
+                await raw_connection.driver_connection.copy_from_table(
+                    self.partition_name(month=month), output=write, format='csv', header=True)
+
+    async def drop_partition(self, month: datetime.date) -> None:
+        name = self.partition_name(month=month)
+        async with async_session() as session:
+            await session.execute(sa.text(f'ALTER TABLE {self.model.__tablename__} DETACH PARTITION {name}'))
+            await session.execute(sa.text(f'DROP TABLE {name}'))
+            await session.commit()
+
+
+class ProductEventRollupQueries(BaseQueries):
+    model = ProductEventRollup
+    conflict_target = ['day', 'shop_id', 'nm_id', 'event_type']
+    group_columns = ['day', 'shop_id', 'nm_id', 'event_type']
+
+    async def add_events(self, histories: list[ProductHistory], session=None) -> None:
+        """Keys are upserted in sorted order so concurrent writers lock the same rows in the same order."""
+        events = collections.Counter(
+            (
+                (history.created_at or datetime.datetime.now()).date(), history.shop_id or 0, history.nm_id or 0,
+                history.event_type or EventType.OTHER
+            )
+            for history in histories
+        )
+        rows = [
+            {'day': day, 'shop_id': shop_id, 'nm_id': nm_id, 'event_type': event_type, 'events': count}
+            for (day, shop_id, nm_id, event_type), count in sorted(events.items())
+        ]
+        statement = insert(self.model)
+        statement = statement.on_conflict_do_update(
+            index_elements=self.conflict_target,
+            set_={'events': self.model.events + statement.excluded.events}
+        )
+        async with self.transaction(session) as session:
+            for start in range(0, len(rows), 1000):
+                await session.execute(statement, rows[start:start + 1000])
+
+    async def get_stats(
+            self, group_by: list[str], shop_id: int = None, nm_id: int = None, event_type: str = None,
+            date_from: datetime.date = None, date_to: datetime.date = None, limit: int = 1000) -> list[dict]:
+        """Sums events over the rollups grouped by group_by columns, date_to is inclusive."""
+        group_columns = [getattr(self.model, column) for column in self.group_columns if column in group_by]
+        query = sa.select(*group_columns, sa.func.sum(self.model.events).label('events'))
+        if shop_id is not None:
+            query = query.where(self.model.shop_id == shop_id)
+        if nm_id is not None:
+            query = query.where(self.model.nm_id == nm_id)
+        if event_type is not None:
+            query = query.where(self.model.event_type == event_type)
+        if date_from is not None:
+            query = query.where(self.model.day >= date_from)
+        if date_to is not None:
+            query = query.where(self.model.day <= date_to)
+        query = query.group_by(*group_columns).order_by(*group_columns).limit(limit)
+        async with async_session() as session:
+            result = await session.execute(query)
+            return [dict(row) for row in result.mappings()]
+
+
+class OutboxEventQueries(BaseQueries):
+    """Events are claimed by pushing next_attempt_at past a lease, every claim counts as an attempt."""
+    model = OutboxEvent
+
+    async def add_events(self, destination: str, payloads: list[dict], session=None) -> None:
+        now = datetime.datetime.now()
+        rows = [
+            {
+                'destination': destination, 'idempotency_key': uuid.uuid4().hex, 'payload': payload,
+                'attempts': 0, 'next_attempt_at': now, 'created_at': now
+            }
+            for payload in payloads
+        ]
+        async with self.transaction(session) as session:
+            for start in range(0, len(rows), 1000):
+                await session.execute(insert(self.model), rows[start:start + 1000])
+
+    async def claim_batch(self, destination: str, limit: int, lease: int, max_attempts: int) -> list[OutboxEvent]:
+        """Takes up to limit due events, oldest first, and hides them from other dispatchers for lease seconds."""
+        now = datetime.datetime.now()
+        due = (
+            sa.select(self.model.id)
+            .where(
+                self.model.destination == destination,
+                self.model.next_attempt_at <= now,
+                self.model.attempts < max_attempts
+            )
+            .order_by(self.model.id)
+            .limit(limit)
+            .with_for_update(skip_locked=True)
+        )
+        async with async_session() as session:
+            result = await session.execute(
+                sa.update(self.model)
+                .where(self.model.id.in_(due))
+                .values(next_attempt_at=now + datetime.timedelta(seconds=lease), attempts=self.model.attempts + 1)
+                .returning(self.model)
+            )
+            events = sorted(result.scalars().all(), key=lambda event: event.id)
+            await session.commit()
+            return events
+
+    @staticmethod
+    def batch_key(events: list[OutboxEvent]) -> str:
+        """Same events give the same key, so a retried batch can be recognised downstream."""
+        return hashlib.sha1(','.join(sorted(event.idempotency_key for event in events)).encode()).hexdigest()
+
+    async def delete_events(self, ids: list[int]) -> None:
+        async with async_session() as session:
+            await session.execute(sa.delete(self.model).where(self.any_of(self.model.id, ids)))
+            await session.commit()
+
+    async def reschedule(self, ids: list[int], error: str, base_delay: int, max_delay: int) -> None:
+        """Retries after base_delay * 2 ** (attempts - 1) seconds, capped at max_delay, with 50% jitter."""
+        delay = sa.func.least(base_delay * sa.func.power(2, self.model.attempts - 1), max_delay)
+        async with async_session() as session:
+            await session.execute(
+                sa.update(self.model)
+                .where(self.any_of(self.model.id, ids))
+                .values(
+                    next_attempt_at=datetime.datetime.now() + sa.func.make_interval(
+                        0, 0, 0, 0, 0, 0, delay * (0.5 + sa.func.random() / 2)),
+                    last_error=error
+                )
+            )
+            await session.commit()
+
 
 class OrderQueries(BaseQueries):
     model = Order
+    conflict_target = ['shop_id', 'orderUid']
+    export_columns = [Order.id, Order.orderUid, Order.nm_id, Order.price_for_sale, Order.status, Order.shop_id]
+
+    def export_criteria(self, shop_id: int = None, status: str = None) -> list:
+        criteria = []
+        if shop_id is not None:
+            criteria.append(self.model.shop_id == shop_id)
+        if status is not None:
+            criteria.append(self.model.status == status)
+        return criteria
 
     async def fetch_all(self) -> list[Order]:
         async with async_session() as session:
@@ -84,6 +377,27 @@ class OrderQueries(BaseQueries):
             )
             return result.scalars().all()
 
+    async def insert_new_orders(self, orders: list[Order], session=None) -> list[Order]:
+        """INSERT ... ON CONFLICT (shop_id, orderUid) DO NOTHING, returns only the rows actually inserted."""
+        rows = self.as_rows(orders, primary_key=False)
+        inserted = []
+        async with self.transaction(session) as session:
+            for start in range(0, len(rows), 1000):
+                result = await session.execute(
+                    insert(self.model.__table__)
+                    .values(rows[start:start + 1000])
+                    .on_conflict_do_nothing(index_elements=self.conflict_target)
+                    .returning(*self.model.__table__.columns)
+                )
+                inserted += [self.model(**row) for row in result.mappings()]
+        return inserted
+
+    async def update_statuses(self, orders: list[Order], session=None) -> None:
+        if orders:
+            async with self.transaction(session) as session:
+                await session.execute(
+                    sa.update(self.model), [{'id': order.id, 'status': order.status} for order in orders])
+
     async def get_not_completed_and_canceled_orders_by_shop_id(self, shop_id: int) -> list[Order]:
         async with async_session() as session:
             result = await session.execute(
@@ -93,4 +407,98 @@ class OrderQueries(BaseQueries):
                 .where(self.model.shop_id == shop_id)
             )
             return result.scalars().all()
-        
\ No newline at end of file
+        
+
+class CardCacheQueries(BaseQueries):
+    model = CardCache
+
+    async def get_by_nm_ids(self, nm_ids: list[int]) -> dict[int, CardCache]:
+        async with async_session() as session:
+            result = await session.execute(
+                sa.select(self.model).where(self.any_of(self.model.nm_id, nm_ids))
+            )
+            return {entry.nm_id: entry for entry in result.scalars().all()}
+
+    async def save_entries(self, entries: list[CardCache]) -> None:
+        if not entries:
+            return
+        statement = insert(self.model).values([
+            {
+                'nm_id': entry.nm_id,
+                'etag': entry.etag,
+                'last_modified': entry.last_modified,
+                'content_hash': entry.content_hash,
+                'checked_at': entry.checked_at
+            }
+            for entry in entries
+        ])
+        statement = statement.on_conflict_do_update(
+            index_elements=[self.model.nm_id],
+            set_={column: statement.excluded[column] for column in ['etag', 'last_modified', 'content_hash', 'checked_at']}
+        )
+        async with async_session() as session:
+            await session.execute(statement)
+            await session.commit()
+
+    async def add_stats(self, requests: int, not_modified: int, unchanged: int) -> None:
+        statement = insert(CardCacheDailyStats).values(
+            day=datetime.date.today(), requests=requests, not_modified=not_modified, unchanged=unchanged)
+        statement = statement.on_conflict_do_update(
+            index_elements=[CardCacheDailyStats.day],
+            set_={
+                column: getattr(CardCacheDailyStats, column) + statement.excluded[column]
+                for column in ['requests', 'not_modified', 'unchanged']
+            }
+        )
+        async with async_session() as session:
+            await session.execute(statement)
+            await session.commit()
+
+    async def get_stats(self, date_from: datetime.date = None, date_to: datetime.date = None) -> dict[str, int]:
+        """Counters summed over the days from date_from to date_to inclusive."""
+        query = sa.select(*[
+            sa.func.coalesce(sa.func.sum(getattr(CardCacheDailyStats, column)), 0).label(column)
+            for column in ['requests', 'not_modified', 'unchanged']
+        ])
+        if date_from is not None:
+            query = query.where(CardCacheDailyStats.day >= date_from)
+        if date_to is not None:
+            query = query.where(CardCacheDailyStats.day <= date_to)
+        async with async_session() as session:
+            result = await session.execute(query)
+            return {key: int(value) for key, value in result.mappings().one().items()}
+
+    async def evict(self, max_size: int) -> None:
+        stale = sa.select(self.model.nm_id).order_by(self.model.checked_at.desc()).offset(max_size)
+        async with async_session() as session:
+            await session.execute(
+                sa.delete(self.model).where(self.model.nm_id.in_(stale))
+            )
+            await session.commit()
+
+
+class OrderCursorQueries(BaseQueries):
+    model = OrderCursor
+    conflict_target = ['shop_id', 'endpoint']
+
+    async def get_cursors(self, shop_id: int) -> dict[str, datetime.datetime]:
+        async with async_session() as session:
+            result = await session.execute(
+                sa.select(self.model).where(self.model.shop_id == shop_id)
+            )
+            return {cursor.endpoint: cursor.last_change_date for cursor in result.scalars().all()}
+
+    async def advance_cursor(self, shop_id: int, endpoint: str, last_change_date: datetime.datetime) -> None:
+        """Moves the cursor forward, an older date never moves it back."""
+        statement = insert(self.model).values(
+            shop_id=shop_id, endpoint=endpoint, last_change_date=last_change_date, updated_at=datetime.datetime.now())
+        statement = statement.on_conflict_do_update(
+            index_elements=self.conflict_target,
+            set_={
+                'last_change_date': sa.func.greatest(self.model.last_change_date, statement.excluded.last_change_date),
+                'updated_at': statement.excluded.updated_at
+            }
+        )
+        async with async_session() as session:
+            await session.execute(statement)
+            await session.commit()
@@ -0,0 +1,40 @@
+import dataclasses
+
+from source.product_management.models import Product, Characteristic
+
+
+@dataclasses.dataclass(slots=True)
+class ParsedCharacteristic:
+    """A characteristic parsed from card.json, only the ones that get saved become Characteristic rows."""
+    name: str | None
+    value: str | None
+    product_nm_id: int | None
+
+    def to_model(self) -> Characteristic:
+        return Characteristic(name=self.name, value=self.value, product_nm_id=self.product_nm_id)
+
+
+@dataclasses.dataclass(slots=True)
+class ParsedProduct:
+    """A product parsed from card.json and the detail endpoint, the price tier fills the price fields only."""
+    nm_id: int | None
+    vendor_code: str | None = None
+    brand: str | None = None
+    subj_name: str | None = None
+    subj_root_name: str | None = None
+    imt_name: str | None = None
+    name: str | None = None
+    description: str | None = None
+    description_hash: str | None = None
+    characteristics_hash: str | None = None
+
+    priceU: int | None = None
+    salePriceU: int | None = None
+    clientSale: int | None = None
+    basicSale: int | None = None
+
+    shop_id: int | None = None
+    shops_supplier: str | None = None
+
+    def to_model(self) -> Product:
+        return Product(**{field.name: getattr(self, field.name) for field in dataclasses.fields(self)})
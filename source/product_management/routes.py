@@ -1,37 +1,100 @@
+import asyncio
+import datetime
 import json
+import shutil
+import tempfile
+import typing
 
-import pandas as pd
-from fastapi import APIRouter, File
+from fastapi import APIRouter, File, Query, UploadFile
 
 from source.core.advertisement_api import AdvertisementApiUtils
-from source.product_management.services import ProductImportServices, ProductServices
+from source.core.settings import settings
+from source.job_management.runner import job_runner
+from source.product_management.queries import ProductEventRollupQueries, CardCacheQueries
+from source.product_management.services import ProductExportServices
+from source.product_management.utils import CardCacheStats
 
 router = APIRouter(prefix='/product-management', tags=['Product Management'])
 
-product_services = ProductServices()
-product_import_services = ProductImportServices()
+product_export_services = ProductExportServices()
+product_event_rollup_queries = ProductEventRollupQueries()
+card_cache_queries = CardCacheQueries()
+
+ExportFormat = typing.Literal['csv', 'csv.gz', 'xlsx']
+StatsGroup = typing.Literal['day', 'shop_id', 'nm_id', 'event_type']
 
 
 @router.get('/launch-product-monitoring/')
 async def launch_product_monitoring():
-    await product_services.product_monitoring()
+    job = await job_runner.enqueue(name='product_monitoring')
+    return {'job_id': job.id}
+
+
+@router.get('/launch-price-monitoring/')
+async def launch_price_monitoring():
+    job = await job_runner.enqueue(name='price_monitoring')
+    return {'job_id': job.id}
 
 
 @router.get('/launch-order-monitoring/')
 async def launch_order_monitoring():
-    await product_services.order_monitoring()
+    job = await job_runner.enqueue(name='order_monitoring')
+    return {'job_id': job.id}
 
 
 @router.get('/launch-order-status-updating/')
 async def launch_order_status_updating():
-    await product_services.order_status_monitoring()
+    job = await job_runner.enqueue(name='order_status_monitoring')
+    return {'job_id': job.id}
+
+
+@router.get('/card-cache-stats/')
+async def get_card_cache_stats(date_from: datetime.date = None, date_to: datetime.date = None):
+    """Counters of the app and worker processes, summed over the given days."""
+    stats = await card_cache_queries.get_stats(date_from=date_from, date_to=date_to)
+    return CardCacheStats(**stats).as_dict()
+
+
+@router.get('/export/product-histories/')
+async def export_product_histories(
+        file_format: ExportFormat = 'csv', shop_id: int = None,
+        date_from: datetime.datetime = None, date_to: datetime.datetime = None):
+    return product_export_services.export_product_histories(
+        file_format=file_format, shop_id=shop_id, date_from=date_from, date_to=date_to)
+
+
+@router.get('/export/products/')
+async def export_products(
+        file_format: ExportFormat = 'csv', shop_id: int = None,
+        date_from: datetime.datetime = None, date_to: datetime.datetime = None):
+    return product_export_services.export_products(
+        file_format=file_format, shop_id=shop_id, date_from=date_from, date_to=date_to)
+
+
+@router.get('/export/orders/')
+async def export_orders(file_format: ExportFormat = 'csv', shop_id: int = None, status: str = None):
+    return product_export_services.export_orders(file_format=file_format, shop_id=shop_id, status=status)
+
+
+@router.get('/stats/events/')
+async def get_event_stats(
+        group_by: list[StatsGroup] = Query(['day', 'event_type']), shop_id: int = None, nm_id: int = None,
+        event_type: str = None, date_from: datetime.date = None, date_to: datetime.date = None,
+        limit: int = Query(1000, le=10000)):
+    """Event counts from the daily rollups, e.g. ?group_by=nm_id&event_type=sale for sales per product."""
+    return await product_event_rollup_queries.get_stats(
+        group_by=group_by, shop_id=shop_id, nm_id=nm_id, event_type=event_type,
+        date_from=date_from, date_to=date_to, limit=limit)
 
 
 @router.post('/import-products-by-excel/')
-async def import_products_by_excel(shop_id: int, file: bytes = File()):
-    df = pd.read_excel(file)
-    nm_id_column = df['Артикул WB'].name
-    await product_import_services.import_products_by_excel(df=df, nm_id_column=nm_id_column, shop_id=shop_id)
+async def import_products_by_excel(shop_id: int, file: UploadFile = File()):
+    """Accepts .xlsx or .csv with an "Артикул WB" column, returns the id of the import job."""
+    suffix = '.csv' if (file.filename or '').lower().endswith('.csv') else '.xlsx'
+    with tempfile.NamedTemporaryFile(dir=settings.JOB_FILES_DIR, suffix=suffix, delete=False) as upload:
+        await asyncio.to_thread(shutil.copyfileobj, file.file, upload)
+    job = await job_runner.enqueue(name='import_products_by_excel', path=upload.name, shop_id=shop_id)
+    return {'job_id': job.id}
 
 
 # @router.post('/test')
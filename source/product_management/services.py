@@ -1,12 +1,23 @@
+import asyncio
 import datetime
+import os
+import socket
+import time
+import typing
 
-import pandas as pd
+from starlette.responses import StreamingResponse
 
 from source.core.advertisement_api import AdvertisementApiUtils
-from source.product_management.models import Product, Characteristic, ProductHistory, Order
+from source.core.settings import settings
+from source.core.xlsx_utils import XlsxUtils
+from source.db.queries import BaseQueries
+from source.job_management.queries import ShardLeaseQueries
+from source.job_management.runner import JobProgress
+from source.product_management.diff import ChangeDetector
+from source.product_management.models import Product, Characteristic, ProductHistory, Order, Shop, EventType
 from source.product_management.queries import ProductQueries, CharacteristicQueries, ProductHistoryQueries, ShopQueries, \
-    OrderQueries
-from source.product_management.utils import ProductUtils, ParsingUtils, WbApiUtils
+    OrderQueries, CardCacheQueries, OrderCursorQueries, OutboxEventQueries
+from source.product_management.utils import ProductUtils, ParsingUtils, WbApiUtils, card_cache_stats
 
 
 class ProductServices:
@@ -15,338 +26,439 @@ class ProductServices:
         self.product_utils = ProductUtils()
         self.parsing_utils = ParsingUtils()
         self.wb_api_utils = WbApiUtils()
+        self.change_detector = ChangeDetector()
 
         self.shop_queries = ShopQueries()
         self.product_queries = ProductQueries()
         self.characteristic_queries = CharacteristicQueries()
         self.history_queries = ProductHistoryQueries()
         self.order_queries = OrderQueries()
+        self.card_cache_queries = CardCacheQueries()
+        self.order_cursor_queries = OrderCursorQueries()
+        self.shard_lease_queries = ShardLeaseQueries()
+        self.outbox_queries = OutboxEventQueries()
+        self.worker_id = f'{socket.gethostname()}:{os.getpid()}'
 
         self.advertisement_api_utils = AdvertisementApiUtils()
 
-    async def product_monitoring(self):
-        saved_products = await self.product_queries.fetch_all()
-        saved_characteristics = await self.characteristic_queries.fetch_all()
+    async def sharded_product_monitoring(self, progress: JobProgress = None):
+        """Requests a sweep over all shards and works on it, alongside the standalone workers, until none is left."""
+        await self.shard_lease_queries.request_sweep(
+            job_name='product_monitoring', shard_count=settings.PRODUCT_MONITORING_SHARDS)
+        progress = progress or JobProgress()
+        await progress.set_total(settings.PRODUCT_MONITORING_SHARDS)
+        await self.monitor_shards(progress=progress)
+
+    async def monitor_shards(self, progress: JobProgress = None) -> int:
+        """Claims due product_monitoring shards one at a time and processes them, returns how many it did."""
+        progress = progress or JobProgress()
+        processed = 0
+        while True:
+            shard = await self.shard_lease_queries.claim_shard(
+                job_name='product_monitoring', shard_count=settings.PRODUCT_MONITORING_SHARDS,
+                owner=self.worker_id, ttl=settings.SHARD_LEASE_TTL)
+            if shard is None:
+                return processed
+
+            work = asyncio.ensure_future(
+                self.product_monitoring(shard=shard, shard_count=settings.PRODUCT_MONITORING_SHARDS))
+            heartbeat = asyncio.ensure_future(self.renew_shard_lease(shard=shard, work=work))
+            finished = False
+            try:
+                await work
+                finished = True
+            except asyncio.CancelledError:
+                # the heartbeat only ends by itself after cancelling the work of a lost lease
+                if not heartbeat.done() or heartbeat.cancelled():
+                    raise
+                print(f'lost the lease of product_monitoring shard {shard}, stopped processing it')
+            finally:
+                work.cancel()
+                heartbeat.cancel()
+                await self.shard_lease_queries.release_shard(
+                    job_name='product_monitoring', shard=shard, owner=self.worker_id, finished=finished)
+            if finished:
+                processed += 1
+                await progress.advance()
+
+    async def renew_shard_lease(self, shard: int, work: asyncio.Future) -> None:
+        """Renews the lease every SHARD_LEASE_TTL / 3 seconds, cancels work once it is lost."""
+        interval = settings.SHARD_LEASE_TTL / 3
+        renewed_at = time.monotonic()
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                renewed = await self.shard_lease_queries.renew_lease(
+                    job_name='product_monitoring', shard=shard, owner=self.worker_id, ttl=settings.SHARD_LEASE_TTL)
+            except Exception as error:
+                print(f'renewing the lease of product_monitoring shard {shard} failed: {error!r}')
+                renewed = time.monotonic() - renewed_at + interval < settings.SHARD_LEASE_TTL
+            else:
+                renewed_at = time.monotonic()
+            if not renewed:
+                work.cancel()
+                return
+
+    async def product_monitoring(self, progress: JobProgress = None, shard: int = None, shard_count: int = None):
+        """Full-content tier, prices are left to the cheaper and more frequent price_monitoring."""
+        criteria = self.product_queries.shard_criteria(shard=shard, shard_count=shard_count)
+        progress = progress or JobProgress()
+        await progress.set_total(await self.product_queries.count(*criteria))
+
+        async for snapshots in self.product_queries.stream_all(
+                *criteria, columns=self.product_queries.snapshot_columns):
+            await self.monitor_products_content(snapshots=snapshots)
+            await progress.advance(len(snapshots))
+
+        await self.card_cache_queries.evict(max_size=settings.CARD_CACHE_MAX_SIZE)
+
+    async def monitor_products_content(self, snapshots: list) -> None:
+        """Compares parsed cards with the snapshot rows, full products and characteristics are loaded only where they differ."""
+        snapshots_dict = {snapshot.nm_id: snapshot for snapshot in snapshots}
+        card_cache = await self.card_cache_queries.get_by_nm_ids(nm_ids=list(snapshots_dict))
+
+        parsed_stream = self.parsing_utils.iter_detail_by_nms(nms=list(snapshots_dict), card_cache=card_cache)
+        async for parsed_products in self.parsing_utils.chunked(
+                stream=parsed_stream, size=settings.PARSING_PERSIST_CHUNK_SIZE):
+            # without a detail brand, name and prices are unknown, not empty, so those articles wait for the next sweep
+            parsed_products = [product for product in parsed_products if product['detail']]
+            unchanged_cards = {product['card']['nm_id'] for product in parsed_products if product['card_unchanged']}
+            parsed_products, parsed_characteristics = self.product_utils.prepare_products_for_saving(
+                products=parsed_products)
+            changed_nm_ids, characteristics_nm_ids = self.change_detector.select_changed(
+                snapshots=snapshots_dict, parsed_products=parsed_products, unchanged_cards=unchanged_cards)
+
+            if changed_nm_ids:
+                saved_products = await self.product_queries.get_by_nm_ids(nm_ids=list(changed_nm_ids))
+                saved_characteristics = await self.characteristic_queries.get_by_product_nm_ids(
+                    nm_ids=list(characteristics_nm_ids))
+                products, characteristics, chars_to_be_deleted, product_histories = \
+                    await self.change_detector.detect_changes(
+                        saved_products=saved_products, saved_characteristics=saved_characteristics,
+                        parsed_products=[product for product in parsed_products if product.nm_id in changed_nm_ids],
+                        parsed_characteristics=[characteristic for characteristic in parsed_characteristics
+                                                if characteristic.product_nm_id in characteristics_nm_ids],
+                        unchanged_cards=unchanged_cards
+                    )
+                await self.save_detected_changes(
+                    products=products, characteristics=characteristics,
+                    chars_to_be_deleted=chars_to_be_deleted, product_histories=product_histories,
+                    product_columns=self.change_detector.content_update_columns)
+            await self.card_cache_queries.save_entries(
+                entries=[card_cache[product.nm_id] for product in parsed_products if product.nm_id in card_cache])
+            counters = card_cache_stats.take()
+            if counters['requests']:
+                await self.card_cache_queries.add_stats(**counters)
+
+    async def price_monitoring(self, progress: JobProgress = None):
+        """Price tier: only the batched detail endpoint, compares price and discount fields."""
+        progress = progress or JobProgress()
+        await progress.set_total(await self.product_queries.count())
+
+        async for snapshots in self.product_queries.stream_all(columns=self.product_queries.price_snapshot_columns):
+            snapshots_dict = {snapshot.nm_id: snapshot for snapshot in snapshots}
+            details_stream = self.parsing_utils.iter_details_by_nms(nms=list(snapshots_dict))
+            async for details in self.parsing_utils.chunked(
+                    stream=details_stream, size=settings.PARSING_PERSIST_CHUNK_SIZE):
+                parsed_products = self.product_utils.prepare_prices_for_saving(details=details)
+                changed_nm_ids = self.change_detector.select_changed_prices(
+                    snapshots=snapshots_dict, parsed_products=parsed_products)
+                if not changed_nm_ids:
+                    continue
 
-        if not saved_products or not saved_products:
+                saved_products_dict = {
+                    product.nm_id: product
+                    for product in await self.product_queries.get_by_nm_ids(nm_ids=list(changed_nm_ids))
+                }
+                products = []
+                product_histories = []
+                for parsed_product in parsed_products:
+                    saved_product = saved_products_dict.get(parsed_product.nm_id)
+                    if not saved_product:
+                        continue
+                    product_to_be_saved, product_history_list = await self.change_detector.detect_change_in_prices(
+                        saved_product=saved_product, parsed_product=parsed_product)
+                    if product_to_be_saved:
+                        products.append(product_to_be_saved)
+                    product_histories += product_history_list
+
+                await self.save_detected_changes(
+                    products=products, characteristics=[], chars_to_be_deleted=[], product_histories=product_histories,
+                    product_columns=self.change_detector.price_update_columns)
+            await progress.advance(len(snapshots))
+
+    async def maintain_history_partitions(self, progress: JobProgress = None):
+        """Creates partitions PRODUCT_HISTORY_PREMAKE_MONTHS ahead, archives and drops the expired ones."""
+        progress = progress or JobProgress()
+        existing_months = await self.history_queries.get_partition_months()
+        month = datetime.date.today().replace(day=1)
+        for _ in range(settings.PRODUCT_HISTORY_PREMAKE_MONTHS + 1):
+            if month not in existing_months:
+                await self.history_queries.create_partition(month=month)
+            month = self.history_queries.next_month(month=month)
+
+        if not settings.PRODUCT_HISTORY_RETENTION_MONTHS:
             return
-
-        parsed_products = await self.parsing_utils.get_detail_by_nms(
-            nms=[product.nm_id for product in saved_products])
-        parsed_products, parsed_characteristics = self.product_utils.prepare_products_for_saving(
-            products=parsed_products)
-
-        products, characteristics, chars_to_be_deleted, product_histories = await self.detect_changes(
-            saved_products=saved_products, saved_characteristics=saved_characteristics,
-            parsed_products=parsed_products, parsed_characteristics=parsed_characteristics
+        oldest_kept_month = datetime.date.today().replace(day=1)
+        for _ in range(settings.PRODUCT_HISTORY_RETENTION_MONTHS):
+            oldest_kept_month = (oldest_kept_month - datetime.timedelta(days=1)).replace(day=1)
+        expired_months = [month for month in existing_months if month < oldest_kept_month]
+        await progress.set_total(len(expired_months))
+        for month in expired_months:
+            if settings.PRODUCT_HISTORY_ARCHIVE_DIR:
+                await self.history_queries.archive_partition(month=month, path=os.path.join(
+                    settings.PRODUCT_HISTORY_ARCHIVE_DIR,
+                    f'{self.history_queries.partition_name(month=month)}.csv.gz'))
+            await self.history_queries.drop_partition(month=month)
+            await progress.advance()
+
+    async def save_detected_changes(
+            self, products: list[Product], characteristics: list[Characteristic],
+            chars_to_be_deleted: list[Characteristic], product_histories: list[ProductHistory],
+            product_columns: list[str]) -> None:
+        """product_columns are the only product columns written, see ChangeDetector.content_update_columns."""
+        # one transaction, hashes saved without their characteristics and histories would never be diffed again
+        async with self.product_queries.transaction() as session:
+            if products:
+                await self.product_queries.bulk_save(
+                    instances=products, update_columns=product_columns, session=session)
+            if characteristics:
+                await self.characteristic_queries.bulk_save(instances=characteristics, session=session)
+            if chars_to_be_deleted:
+                await self.characteristic_queries.delete_instances(instances=chars_to_be_deleted, session=session)
+            if product_histories:
+                await self.history_queries.save_histories(histories=product_histories, session=session)
+
+    async def save_and_notify_histories(self, histories: list[ProductHistory], session=None) -> None:
+        """Saves histories and queues them for the advertisement service in the same transaction."""
+        await self.history_queries.save_histories(
+            histories=histories, session=session,
+            outbox_destination=self.advertisement_api_utils.outbox_destination,
+            outbox_payloads=[self.advertisement_api_utils.detected_change_payload(change) for change in histories]
         )
-        if products:
-            await self.product_queries.save_in_db(products, many=True)
-        if characteristics:
-            await self.characteristic_queries.save_in_db(characteristics, many=True)
-        if chars_to_be_deleted:
-            await self.characteristic_queries.delete_instances(instances=chars_to_be_deleted)
-        if product_histories:
-            # await self.advertisement_api_utils.send_detected_changes(detected_changes=product_histories)
-            await self.history_queries.save_in_db(product_histories, many=True)
-
-    async def detect_changes(
-            self, saved_products: list[Product], saved_characteristics: list[Characteristic],
-            parsed_products: list[Product], parsed_characteristics: list[Characteristic]) -> list[dict]:
-
-        saved_products_df = pd.DataFrame([
-            {'nm_id': product.nm_id, 'saved_product': product}
-            for product in saved_products
-        ])
-        parsed_products_df = pd.DataFrame([
-            {'nm_id': product.nm_id, 'parsed_product': product}
-            for product in parsed_products
-        ])
-        df = pd.merge(saved_products_df, parsed_products_df, how='inner', left_on='nm_id', right_on='nm_id')
-
-        saved_characteristics_dict = dict()
-        parsed_characteristics_dict = dict()
-        for characteristic in saved_characteristics:
-            if saved_characteristics_dict.get(characteristic.product_nm_id):
-                saved_characteristics_dict[characteristic.product_nm_id].append(characteristic)
-            else:
-                saved_characteristics_dict[characteristic.product_nm_id] = [characteristic]
-
-        for characteristic in parsed_characteristics:
-            if parsed_characteristics_dict.get(characteristic.product_nm_id):
-                parsed_characteristics_dict[characteristic.product_nm_id].append(characteristic)
-            else:
-                parsed_characteristics_dict[characteristic.product_nm_id] = [characteristic]
-
-        products_to_be_saved = []
-        characteristics_to_be_saved = []
-        characteristics_to_be_deleted = []
-        product_history_to_be_saved = []
-        for index in df.index:
-            saved_product: Product = df['saved_product'][index]
-            parsed_product: Product = df['parsed_product'][index]
-            saved_product_characteristics = saved_characteristics_dict.get(saved_product.nm_id, [])
-            parsed_product_characteristics = parsed_characteristics_dict.get(parsed_product.nm_id, [])
-
-            product_to_be_saved, product_history_list = await self.detect_change_in_product(
-                saved_product=saved_product, parsed_product=parsed_product)
-
-            chars_to_be_saved, chars_to_be_deleted, char_history = await self.detect_change_in_characteristics(
-                saved_characteristics=saved_product_characteristics,
-                parsed_characteristics=parsed_product_characteristics,
-                product_nm_id=saved_product.nm_id,
-                shop_id=saved_product.shop_id,
-                shops_supplier=saved_product.shops_supplier,
-            )
-            if product_to_be_saved:
-                products_to_be_saved.append(product_to_be_saved)
-
-            characteristics_to_be_saved += chars_to_be_saved
-            characteristics_to_be_deleted += chars_to_be_deleted
-            product_history_to_be_saved += product_history_list + char_history
-
-        return products_to_be_saved, characteristics_to_be_saved, characteristics_to_be_deleted, product_history_to_be_saved
-
-    @staticmethod
-    async def detect_change_in_product(saved_product: Product, parsed_product: Product) -> list[ProductHistory]:
-        actions = []
-        if saved_product.vendor_code != parsed_product.vendor_code:
-            actions.append(f'Замечено изменение вендор кода товара \n с {saved_product.vendor_code} на {parsed_product.vendor_code}')
-            saved_product.vendor_code = parsed_product.vendor_code
-
-        if saved_product.brand != parsed_product.brand:
-            actions.append(
-                f'Замечено изменение бренда товара \n с "{saved_product.brand}" на "{parsed_product.brand}"')
-            saved_product.brand = parsed_product.brand
-
-        if saved_product.subj_name != parsed_product.subj_name:
-            actions.append(f'Замечено изменение подкатегории товара \n с "{saved_product.subj_name}" на "{parsed_product.subj_name}"')
-            saved_product.subj_name = parsed_product.subj_name
-
-        if saved_product.imt_name != parsed_product.imt_name:
-            actions.append(f'Замечено изменение imt_name товара \n с "{saved_product.imt_name}" на "{parsed_product.imt_name}"')
-            saved_product.imt_name = parsed_product.imt_name
-
-        if saved_product.name != parsed_product.name:
-            actions.append(f'Замечено изменение в наименовании товара \n с "{saved_product.name}" на "{parsed_product.name}"')
-            saved_product.name = parsed_product.name
-
-        if saved_product.description != parsed_product.description:
-            actions.append(f'Замечено изменение в описании товара \n с "{saved_product.description}" на "{parsed_product.description}"')
-            saved_product.description = parsed_product.description
-
-        if saved_product.priceU != parsed_product.priceU:
-            actions.append(f'Замечено изменение в цене товара до скидки\n с "{saved_product.priceU}" на "{parsed_product.priceU}"')
-            saved_product.priceU = parsed_product.priceU
-
-        if saved_product.salePriceU != parsed_product.salePriceU:
-            actions.append(f'Замечено изменение в цене товара после скидки\n с "{saved_product.salePriceU}" на "{parsed_product.salePriceU}"')
-            saved_product.salePriceU = parsed_product.salePriceU
-
-        if saved_product.clientSale != parsed_product.clientSale:
-            actions.append(f'Замечено изменение скидки товара ССП\n с "{saved_product.clientSale}" на "{parsed_product.clientSale}"')
-            saved_product.clientSale = parsed_product.clientSale
-
-        if saved_product.basicSale != parsed_product.basicSale:
-            actions.append(f'Замечено изменение скидки покупателя товара \n с "{saved_product.basicSale}" на "{parsed_product.basicSale}"')
-            saved_product.basicSale = parsed_product.basicSale
-
-        if actions:
-            saved_product.updated_at = datetime.datetime.now()
-            return saved_product, [
-                ProductHistory(
-                    nm_id=saved_product.nm_id,
-                    action=action,
-                    created_at=datetime.datetime.now(),
-                    shop_id=saved_product.shop_id,
-                    shops_supplier=saved_product.shops_supplier,
-                )
-                for action in actions
-            ]
-        return None, []
 
-    @staticmethod
-    async def detect_change_in_characteristics(
-            saved_characteristics: list[Characteristic],
-            parsed_characteristics: list[Characteristic],
-            product_nm_id: int,
-            shop_id: int,
-            shops_supplier: str,
-    ) -> list[ProductHistory]:
-        saved_characteristics_df = pd.DataFrame([
-            {
-                'nm_id': characteristic.product_nm_id,
-                'keyword': characteristic.name,
-                'saved_characteristic': characteristic}
-            for characteristic in saved_characteristics
-        ])
-        parsed_characteristics_df = pd.DataFrame([
-            {
-                'nm_id': characteristic.product_nm_id,
-                'keyword': characteristic.name,
-                'parsed_characteristic': characteristic
-            }
-            for characteristic in parsed_characteristics
-        ])
-        df = pd.merge(saved_characteristics_df, parsed_characteristics_df, how='outer',
-                      left_on=['nm_id', 'keyword'], right_on=['nm_id', 'keyword'])
-
-        characteristics_to_be_saved = []
-        characteristics_to_be_deleted = []
-        actions = []
-
-        for index in df.index:
-            saved_characteristic = df['saved_characteristic'][index]
-            parsed_characteristic = df['parsed_characteristic'][index]
-
-            if pd.isna(saved_characteristic):
-                actions.append(f'Добавлена новая характеристика товара с названием {parsed_characteristic.name} и со значением {parsed_characteristic.value}')
-                characteristics_to_be_saved.append(parsed_characteristic)
-                continue
-
-            if pd.isna(parsed_characteristic):
-                actions.append(f'Удалена характеристика товара с названием {saved_characteristic.name} и со значением {saved_characteristic.value}')
-                characteristics_to_be_deleted.append(saved_characteristic)
-                continue
+    async def dispatch_outbox(self, progress: JobProgress = None) -> None:
+        """A sender stops at its first failed batch, the batch is retried later with exponential backoff."""
+        progress = progress or JobProgress()
+        destination = self.advertisement_api_utils.outbox_destination
+
+        async def drain():
+            while True:
+                events = await self.outbox_queries.claim_batch(
+                    destination=destination, limit=settings.OUTBOX_BATCH_SIZE,
+                    lease=settings.OUTBOX_LEASE_TTL, max_attempts=settings.OUTBOX_MAX_ATTEMPTS)
+                if not events:
+                    return
+                ids = [event.id for event in events]
+                try:
+                    await self.advertisement_api_utils.send_detected_changes(
+                        payload_changes=[
+                            {**event.payload, 'idempotency_key': event.idempotency_key} for event in events
+                        ],
+                        idempotency_key=self.outbox_queries.batch_key(events=events)
+                    )
+                except Exception as error:
+                    print(f'outbox batch of {len(events)} {destination} events failed: {error!r}')
+                    await self.outbox_queries.reschedule(
+                        ids=ids, error=repr(error), base_delay=settings.OUTBOX_RETRY_BASE_DELAY,
+                        max_delay=settings.OUTBOX_RETRY_MAX_DELAY)
+                    return
+                await self.outbox_queries.delete_events(ids=ids)
+                await progress.advance(len(events))
+
+        await asyncio.gather(*[drain() for _ in range(settings.OUTBOX_DISPATCH_CONCURRENCY)])
+
+    async def for_each_shop(
+            self, shops: list[Shop], handler: typing.Callable[[Shop], typing.Awaitable],
+            progress: JobProgress = None) -> None:
+        """Runs handler for every shop, a failing shop does not stop the others."""
+        progress = progress or JobProgress()
+        await progress.set_total(len(shops))
+        semaphore = asyncio.Semaphore(settings.SHOP_MONITORING_CONCURRENCY)
+
+        async def run(shop: Shop):
+            async with semaphore:
+                try:
+                    await handler(shop)
+                finally:
+                    await progress.advance()
 
-            if saved_characteristic.value != parsed_characteristic.value:
-                actions.append(f'Поменялось значение характеристики {saved_characteristic.name} с {saved_characteristic.value} на {parsed_characteristic.value}')
-                saved_characteristic.value = parsed_characteristic.value
-                characteristics_to_be_saved.append(saved_characteristic)
+        results = await asyncio.gather(*[run(shop) for shop in shops], return_exceptions=True)
+        for shop, result in zip(shops, results):
+            if isinstance(result, Exception):
+                print(f'{handler.__name__} failed for shop {shop.id}: {result!r}')
+                progress.add_error(f'shop {shop.id}: {result!r}')
 
-        if actions:
-            return characteristics_to_be_saved, characteristics_to_be_deleted, [
-                ProductHistory(
-                    nm_id=product_nm_id,
-                    action=action,
-                    created_at=datetime.datetime.now(),
-                    shop_id=shop_id,
-                    shops_supplier=shops_supplier
-                )
-                for action in actions
-            ]
-        return characteristics_to_be_saved, characteristics_to_be_deleted, []
-
-    async def order_monitoring(self):
+    async def order_monitoring(self, progress: JobProgress = None):
         shops = await self.shop_queries.fetch_all()
+        await self.for_each_shop(shops=shops, handler=self.shop_order_monitoring, progress=progress)
 
-        for shop in shops:
-            statistic_auth = self.wb_api_utils.auth(api_key=shop.api_token_statistic)
-            standard_auth = self.wb_api_utils.auth(api_key=shop.api_token_standard)
-
-            orders = await self.wb_api_utils.get_shops_orders(token_auth=standard_auth)
-            orders = self.product_utils.prepare_orders_for_saving(orders=orders, shop_id=shop.id, object='id')
-
-            fbo_orders = await self.wb_api_utils.get_shops_orders_fbo(token_auth=statistic_auth)
-            fbo_orders = self.product_utils.prepare_orders_for_saving(
-                orders=fbo_orders, shop_id=shop.id, object='srid')
-
-            sales = await self.wb_api_utils.get_shops_sales(token_auth=statistic_auth)
-            sales = self.product_utils.prepare_orders_for_saving(orders=sales, shop_id=shop.id, object='saleID')
+    async def shop_order_monitoring(self, shop: Shop):
+        statistic_auth = self.wb_api_utils.auth(api_key=shop.api_token_statistic)
+        standard_auth = self.wb_api_utils.auth(api_key=shop.api_token_standard)
 
-            orders += fbo_orders + sales
-
-            saved_orders = await self.order_queries.get_orders_by_shop_id(shop_id=shop.id)
-            saved_orders_dict = dict()
-            for saved_order in saved_orders:
-                saved_orders_dict[saved_order.orderUid] = True
+        cursors = await self.order_cursor_queries.get_cursors(shop_id=shop.id)
+        orders, fbo_orders, sales = await asyncio.gather(
+            self.wb_api_utils.get_shops_orders(token_auth=standard_auth),
+            self.wb_api_utils.get_shops_orders_fbo(token_auth=statistic_auth, date_from=cursors.get('orders')),
+            self.wb_api_utils.get_shops_sales(token_auth=statistic_auth, date_from=cursors.get('sales')),
+        )
+        next_cursors = {
+            'orders': self.product_utils.get_last_change_date(items=fbo_orders),
+            'sales': self.product_utils.get_last_change_date(items=sales),
+        }
+        orders = self.product_utils.prepare_orders_for_saving(orders=orders, shop_id=shop.id, object='id')
+        fbo_orders = self.product_utils.prepare_orders_for_saving(orders=fbo_orders, shop_id=shop.id, object='srid')
+        sales = self.product_utils.prepare_orders_for_saving(orders=sales, shop_id=shop.id, object='saleID')
+
+        orders += fbo_orders + sales
+
+        saved_nm_ids = await self.product_queries.get_saved_nm_ids(
+            shop_id=shop.id, nm_ids=list({order.nm_id for order in orders if order.nm_id is not None}))
+        # new orders, their histories and outbox events are committed together, or not at all
+        async with self.order_queries.transaction() as session:
+            orders = await self.order_queries.insert_new_orders(
+                orders=[order for order in orders if order.nm_id not in saved_nm_ids], session=session)
+            await self.save_and_notify_histories(
+                histories=self.make_order_histories(shop=shop, orders=orders), session=session)
+
+        for endpoint, last_change_date in next_cursors.items():
+            if last_change_date:
+                await self.order_cursor_queries.advance_cursor(
+                    shop_id=shop.id, endpoint=endpoint, last_change_date=last_change_date)
 
-            saved_products = await self.product_queries.get_products_by_shop_id(shop_id=shop.id)
-            saved_products_dict = dict()
+    @staticmethod
+    def make_order_histories(shop: Shop, orders: list[Order]) -> list[ProductHistory]:
+        history = []
+        for order in orders:
+            if order.status == 'new':
+                event_type, action = EventType.ORDER_NEW, f'Новое сборочное задание у товара с артикулом {order.nm_id}'
+            elif order.orderUid[0] == 'S':
+                event_type, action = EventType.SALE, f'Продажа товара с артикулом {order.nm_id}'
+            elif order.orderUid[0] == 'R':
+                event_type, action = EventType.RETURN, f'Возврат товара с артикулом {order.nm_id}'
+            elif 'canceled' not in order.orderUid:
+                event_type, action = EventType.ORDER, f'Новый заказ у товара с артикулом {order.nm_id}'
+            else:
+                event_type, action = EventType.CANCEL, f'Отмена заказа у товара с артикулом {order.nm_id}'
+
+            history.append(ProductHistory(
+                nm_id=order.nm_id,
+                action=action,
+                event_type=event_type,
+                created_at=datetime.datetime.now(),
+                shop_id=shop.id,
+                shops_supplier=shop.supplier
+            ))
+        return history
+
+    async def order_status_monitoring(self, progress: JobProgress = None):
+        shops = await self.shop_queries.fetch_all()
+        await self.for_each_shop(shops=shops, handler=self.shop_order_status_monitoring, progress=progress)
 
-            for saved_product in saved_products:
-                saved_products_dict[saved_product.nm_id] = True
+    async def shop_order_status_monitoring(self, shop: Shop):
+        standard_auth = self.wb_api_utils.auth(api_key=shop.api_token_standard)
+        orders = await self.order_queries.get_not_completed_and_canceled_orders_by_shop_id(shop_id=shop.id)
 
-            orders = [order for order in orders
-                      if not saved_orders_dict.get(order.orderUid) and not saved_products_dict.get(order.nm_id)]
+        valid_orders = dict()
+        for order in orders:
+            try:
+                valid_orders[int(order.orderUid)] = order
+            except ValueError:
+                continue
+        if not valid_orders:
+            return
+        statuses = await self.wb_api_utils.get_order_statuses(order_ids=list(valid_orders), token_auth=standard_auth)
 
-            history = []
-            for order in orders:
-                if order.status == 'new':
-                    action = f'Новое сборочное задание у товара с артикулом {order.nm_id}'
-                elif order.orderUid[0] in ['S', 'R']:
-                    action = f'Продажа товара с артикулом {order.nm_id}' if order.orderUid[0] == 'S' else \
-                        f"Возврат товара с артикулом {order.nm_id}"
-                else:
-                    action = f'Новый заказ у товара с артикулом {order.nm_id}' if 'canceled' not in order.orderUid else \
-                        f'Отмена заказа у товара с артикулом {order.nm_id}'
+        history = []
+        orders_to_be_saved = []
+        for status in statuses:
+            saved_order = valid_orders.get(status.get('id', 0))
+            if saved_order is None:
+                continue
+            supplier_status: str = status.get('supplierStatus', '')
 
+            if saved_order.status != supplier_status:
                 history.append(ProductHistory(
-                    nm_id=order.nm_id,
-                    action=action,
+                    nm_id=saved_order.nm_id,
+                    price_for_sale=saved_order.price_for_sale,
+                    action=f'Изменился статус сборочного задания с "{saved_order.status}" на "{supplier_status}"',
+                    event_type=EventType.STATUS_CHANGE,
                     created_at=datetime.datetime.now(),
+                    shops_supplier=shop.supplier,
                     shop_id=shop.id,
-                    shops_supplier=shop.supplier
                 ))
-            if history:
-                await self.advertisement_api_utils.send_detected_changes(detected_changes=history)
+                saved_order.status = supplier_status
+                orders_to_be_saved.append(saved_order)
 
-                await self.history_queries.save_in_db(instances=history, many=True)
-                await self.order_queries.save_in_db(instances=orders, many=True)
-
-    async def order_status_monitoring(self):
-        for shop in await self.shop_queries.fetch_all():
-            standard_auth = self.wb_api_utils.auth(api_key=shop.api_token_standard)
-            orders = await self.order_queries.get_not_completed_and_canceled_orders_by_shop_id(shop_id=shop.id)
-
-            order_ids = []
-            valid_orders = []
-            for order in valid_orders:
-                try:
-                    order_id = int(order.orderUid)
-                    order_ids.append(order_id)
-                    orders.append(order)
-                except ValueError:
-                    continue
-            statuses = await self.wb_api_utils.get_order_statuses(order_ids=order_ids, token_auth=standard_auth)
-
-            orders_df = pd.DataFrame([
-                {'order_id': int(order.orderUid), 'saved_order': order}
-                for order in valid_orders
-            ])
-            statuses_df = pd.DataFrame([
-                {'order_id': status.get('id', 0), 'status': status}
-                for status in statuses
-            ])
-            if statuses_df.empty or orders_df.empty:
-                continue
-
-            df = pd.merge(orders_df, statuses_df, how='inner', left_on='order_id', right_on='order_id')
-
-            history = []
-            orders_to_be_saved = []
-            for index in df.index:
-                saved_order: Order = df['saved_order'][index]
-                status: str = df['status'][index].get('supplierStatus', '')
-
-                if saved_order.status != status:
-                    history.append(ProductHistory(
-                        nm_id=saved_order.nm_id,
-                        price_for_sale=saved_order.price_for_sale,
-                        action=f'Изменился статус сборочного задания с "{saved_order.status}" на "{status}"',
-                        created_at=datetime.datetime.now(),
-                        shops_supplier=shop.supplier,
-                        shop_id=shop.id,
-                    ))
-                    saved_order.status = status
-                    orders_to_be_saved.append(saved_order)
-
-            if history:
-                await self.advertisement_api_utils.send_detected_changes(history)
-                await self.history_queries.save_in_db(instances=history, many=True)
-                await self.order_queries.save_in_db(instances=orders_to_be_saved, many=True)
+        if history:
+            async with self.order_queries.transaction() as session:
+                await self.save_and_notify_histories(histories=history, session=session)
+                await self.order_queries.update_statuses(orders=orders_to_be_saved, session=session)
 
 
 class ProductImportServices(ProductServices):
+    xlsx_utils = XlsxUtils()
 
-    async def import_products_by_excel(self, df: pd.DataFrame, nm_id_column: str, shop_id: int) -> None:
+    async def import_products_by_excel(
+            self, path: str, shop_id: int, nm_id_column: str = 'Артикул WB',
+            progress: JobProgress = None, resume_from: int = 0) -> None:
+        """Progress counts the rows consumed, so a failed import can be continued with resume_from."""
         shop = await self.shop_queries.get_shop_by_id(shop_id=shop_id)
         if not shop:
-            return
-        nm_ids = list(df[nm_id_column])
-        products = await self.parsing_utils.get_detail_by_nms(nms=nm_ids)
-        products, characteristics = self.product_utils.prepare_products_for_saving(
-            products=products, shop_id=shop_id, shops_supplier=shop.supplier)
-        await self.product_queries.save_in_db(instances=products, many=True)
-        await self.product_queries.save_in_db(instances=characteristics, many=True)
-
+            raise ValueError(f'Shop {shop_id} not found')
+        progress = progress or JobProgress()
+        await progress.set_total(await asyncio.to_thread(self.xlsx_utils.count_rows, path))
+        await progress.advance(resume_from)
+
+        async for values in self.xlsx_utils.read_column_chunks(
+                path=path, column=nm_id_column, chunk_size=settings.IMPORT_CHUNK_SIZE, skip=resume_from):
+            nm_ids = self.product_utils.parse_nm_ids(values=values)
+            existing_nm_ids = await self.product_queries.get_existing_nm_ids(nm_ids=nm_ids) if nm_ids else set()
+            nm_ids = [nm_id for nm_id in nm_ids if nm_id not in existing_nm_ids]
+
+            if nm_ids:
+                products = await self.parsing_utils.get_detail_by_nms(nms=nm_ids)
+                products, characteristics = self.product_utils.prepare_products_for_saving(
+                    products=products, shop_id=shop_id, shops_supplier=shop.supplier)
+                # a failed card.json fetch leaves nm_id empty, such a row would break every later detail batch
+                products = [product for product in products if product.nm_id is not None]
+                characteristics = [
+                    characteristic for characteristic in characteristics if characteristic.product_nm_id is not None]
+                missing = set(nm_ids) - {product.nm_id for product in products}
+                if missing:
+                    progress.add_error(f'{len(missing)} nm ids could not be fetched: {sorted(missing)[:20]}')
+                await self.product_queries.bulk_save(instances=[product.to_model() for product in products])
+                await self.characteristic_queries.bulk_save(
+                    instances=[characteristic.to_model() for characteristic in characteristics])
+            await progress.advance(len(values))
+
+
+class ProductExportServices(ProductServices):
+    xlsx_utils = XlsxUtils()
+
+    def export(self, queries: BaseQueries, criteria: list, file_name: str, file_format: str) -> StreamingResponse:
+        """Streams queries.export_columns of the matching rows, DB_STREAM_CHUNK_SIZE rows are read at a time."""
+        return self.xlsx_utils.export_response(
+            header=[column.key for column in queries.export_columns],
+            chunks=queries.stream_all(*criteria, columns=queries.export_columns),
+            file_name=file_name, file_format=file_format)
+
+    def export_product_histories(
+            self, file_format: str, shop_id: int = None,
+            date_from: datetime.datetime = None, date_to: datetime.datetime = None) -> StreamingResponse:
+        return self.export(
+            queries=self.history_queries, file_name='product_histories', file_format=file_format,
+            criteria=self.history_queries.export_criteria(shop_id=shop_id, date_from=date_from, date_to=date_to))
+
+    def export_products(
+            self, file_format: str, shop_id: int = None,
+            date_from: datetime.datetime = None, date_to: datetime.datetime = None) -> StreamingResponse:
+        return self.export(
+            queries=self.product_queries, file_name='products', file_format=file_format,
+            criteria=self.product_queries.export_criteria(shop_id=shop_id, date_from=date_from, date_to=date_to))
+
+    def export_orders(self, file_format: str, shop_id: int = None, status: str = None) -> StreamingResponse:
+        return self.export(
+            queries=self.order_queries, file_name='orders', file_format=file_format,
+            criteria=self.order_queries.export_criteria(shop_id=shop_id, status=status))
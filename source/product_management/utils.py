@@ -1,21 +1,34 @@
+import asyncio
 import datetime
+import hashlib
+import json
+import typing
 
-from source.core.base_utils import BaseUtils
-import asyncio
+from dateutil.parser import isoparse
 
-from source.product_management.models import Product, Characteristic, Order
+from source.core.base_utils import BaseUtils, RateLimiter
+from source.core.settings import settings
+from source.product_management.models import Product, Order, CardCache
+from source.product_management.records import ParsedProduct, ParsedCharacteristic
 
 
 class ProductUtils(BaseUtils):
 
     @staticmethod
     def prepare_products_for_saving(
-            products: list[dict], shop_id: int = None, shops_supplier: str = None) -> tuple:
+            products: list[dict], shop_id: int = None,
+            shops_supplier: str = None) -> tuple[list[ParsedProduct], list[ParsedCharacteristic]]:
+        """Plain slotted records, callers turn the ones they persist into models with to_model()."""
         products_to_be_saved = []
         characteristics_to_be_saved = []
         for product in products:
             extended = product['detail'].get('extended', {})
-            product_to_be_saved = Product(
+            characteristics = [
+                ParsedCharacteristic(
+                    name=option.get('name'), value=option.get('value'), product_nm_id=product['card'].get('nm_id'))
+                for option in product['card'].get('options', []) if option.get('name') is not None
+            ]
+            product_to_be_saved = ParsedProduct(
                 nm_id=product['card'].get('nm_id'),
                 vendor_code=product['card'].get('vendor_code'),
                 brand=product['detail'].get('brand'),
@@ -24,6 +37,8 @@ class ProductUtils(BaseUtils):
                 imt_name=product['card'].get('imt_name'),
                 name=product['detail'].get('name'),
                 description=product['card'].get('description'),
+                description_hash=ProductUtils.text_hash(text=product['card'].get('description')),
+                characteristics_hash=ProductUtils.characteristics_hash(characteristics=characteristics),
 
                 priceU=product['detail'].get('priceU', 0) // 100,
                 salePriceU=product['detail'].get('salePriceU', 0) // 100,
@@ -33,14 +48,57 @@ class ProductUtils(BaseUtils):
                 shops_supplier=shops_supplier
             )
             products_to_be_saved.append(product_to_be_saved)
-            for option in product['card'].get('options', []):
-                characteristics_to_be_saved.append(Characteristic(
-                    name=option.get('name'),
-                    value=option.get('value'),
-                    product_nm_id=product_to_be_saved.nm_id
-                ))
+            characteristics_to_be_saved += characteristics
         return products_to_be_saved, characteristics_to_be_saved
 
+    @staticmethod
+    def parse_nm_ids(values: typing.Iterable) -> list[int]:
+        """Distinct nm ids in their original order, empty and non-numeric cells are dropped."""
+        nm_ids = dict()
+        for value in values:
+            try:
+                nm_ids[int(float(value))] = None
+            except (TypeError, ValueError, OverflowError):
+                continue
+        return list(nm_ids)
+
+    @staticmethod
+    def text_hash(text: str | None) -> str | None:
+        """md5 hex digest of the utf-8 text, the same value as Postgres' md5(text)."""
+        if text is None:
+            return None
+        return hashlib.md5(text.encode()).hexdigest()
+
+    @staticmethod
+    def characteristics_hash(characteristics: list[ParsedCharacteristic]) -> str:
+        """Hash of the product's (name, value) pairs, independent of their order."""
+        pairs = sorted(
+            ([characteristic.name, characteristic.value] for characteristic in characteristics),
+            key=lambda pair: (pair[0] or '', pair[1] or '')
+        )
+        return hashlib.md5(json.dumps(pairs, ensure_ascii=False).encode()).hexdigest()
+
+    @staticmethod
+    def copy_card_fields(source: Product, target: ParsedProduct) -> None:
+        """Fills the fields that come from card.json, used when the card is known to be unchanged."""
+        for field in ['vendor_code', 'subj_name', 'subj_root_name', 'imt_name', 'description',
+                      'description_hash', 'characteristics_hash']:
+            setattr(target, field, getattr(source, field))
+
+    @staticmethod
+    def prepare_prices_for_saving(details: list[dict]) -> list[ParsedProduct]:
+        products_to_be_saved = []
+        for detail in details:
+            extended = detail.get('extended', {})
+            products_to_be_saved.append(ParsedProduct(
+                nm_id=detail.get('id'),
+                priceU=detail.get('priceU', 0) // 100,
+                salePriceU=detail.get('salePriceU', 0) // 100,
+                clientSale=extended.get('clientSale'),
+                basicSale=extended.get('basicSale'),
+            ))
+        return products_to_be_saved
+
     @staticmethod
     def prepare_orders_for_saving(orders: list[dict], shop_id: int, object: str) -> list[Order]:
         output_data = []
@@ -66,12 +124,19 @@ class ProductUtils(BaseUtils):
             ))
         return output_data
 
+    @staticmethod
+    def get_last_change_date(items: list[dict]) -> datetime.datetime | None:
+        """Latest lastChangeDate of statistics API records, the cursor to poll from next time."""
+        dates = [isoparse(item['lastChangeDate']).replace(tzinfo=None) for item in items if item.get('lastChangeDate')]
+        return max(dates) if dates else None
+
     @staticmethod
     def filter_recently_added_orders(orders: list[Order]) -> list[Order]:
         pass
 
 
 class WbApiUtils(BaseUtils):
+    rate_limiter = RateLimiter(rate=settings.WB_API_RATE_LIMIT, capacity=settings.WB_API_RATE_BURST)
 
     @staticmethod
     def auth(api_key: str) -> dict:
@@ -79,66 +144,190 @@ class WbApiUtils(BaseUtils):
             'Authorization': api_key
         }
 
+    async def make_get_request(self, url, headers, no_json=False):
+        await self.rate_limiter.acquire(key=headers.get('Authorization'))
+        return await super().make_get_request(url=url, headers=headers, no_json=no_json)
+
+    async def make_post_request(self, url, headers, payload, no_json=False):
+        await self.rate_limiter.acquire(key=headers.get('Authorization'))
+        return await super().make_post_request(url=url, headers=headers, payload=payload, no_json=no_json)
+
     async def get_shops_orders(self, token_auth: dict) -> list[dict]:
         url = 'https://suppliers-api.wildberries.ru/api/v3/orders/new'
         data = await self.make_get_request(url=url, headers=token_auth)
         return data.get('orders', [])
 
-    async def get_shops_orders_fbo(self, token_auth: dict) -> list[dict]:
-        dateFrom = datetime.datetime.now() - datetime.timedelta(minutes=40)
+    async def get_shops_orders_fbo(self, token_auth: dict, date_from: datetime.datetime = None) -> list[dict]:
+        dateFrom = date_from or datetime.datetime.now() - datetime.timedelta(minutes=40)
         url = f'https://statistics-api.wildberries.ru/api/v1/supplier/orders?dateFrom={str(dateFrom).replace(" ", "T")}'
         data = await self.make_get_request(url=url, headers=token_auth)
         return data if data else []
 
-    async def get_shops_sales(self, token_auth: dict) -> list[dict]:
-        dateFrom = datetime.datetime.now() - datetime.timedelta(minutes=40)
+    async def get_shops_sales(self, token_auth: dict, date_from: datetime.datetime = None) -> list[dict]:
+        dateFrom = date_from or datetime.datetime.now() - datetime.timedelta(minutes=40)
         url = f'https://statistics-api.wildberries.ru/api/v1/supplier/sales?dateFrom={str(dateFrom).replace(" ", "T")}'
         data = await self.make_get_request(url=url, headers=token_auth)
         return data if data else []
 
     async def get_order_statuses(self, token_auth: dict, order_ids: list[int]) -> list[dict]:
-        orders_ids = order_ids[1000:]
+        """Statuses of all order_ids, ORDER_STATUS_CHUNK_SIZE ids per request and several requests at once."""
+        chunk_size = settings.ORDER_STATUS_CHUNK_SIZE
+        statuses = []
+        async for chunk_statuses in self.stream_concurrently(
+                items=[order_ids[index:index + chunk_size] for index in range(0, len(order_ids), chunk_size)],
+                worker=lambda chunk: self.get_order_statuses_chunk(token_auth=token_auth, order_ids=chunk),
+                concurrency=settings.ORDER_STATUS_CONCURRENCY):
+            statuses += chunk_statuses
+        return statuses
+
+    async def get_order_statuses_chunk(self, token_auth: dict, order_ids: list[int]) -> list[dict]:
         url = 'https://suppliers-api.wildberries.ru/api/v3/orders/status'
-        data = await self.make_post_request(headers=token_auth, url=url, payload=dict(orders=orders_ids))
-        return data.get('orders', [])
+        data = await self.make_post_request(headers=token_auth, url=url, payload=dict(orders=order_ids))
+        return data.get('orders', []) if data else []
+
+
+class CardCacheStats:
+    """Counters of conditional card.json requests, flushed to card_cache_daily_stats with take()."""
+
+    def __init__(self, requests: int = 0, not_modified: int = 0, unchanged: int = 0):
+        self.requests = requests
+        self.not_modified = not_modified
+        self.unchanged = unchanged
+
+    def take(self) -> dict[str, int]:
+        counters = {'requests': self.requests, 'not_modified': self.not_modified, 'unchanged': self.unchanged}
+        self.requests = self.not_modified = self.unchanged = 0
+        return counters
+
+    @property
+    def hit_rate(self) -> float:
+        return (self.not_modified + self.unchanged) / self.requests if self.requests else 0.0
+
+    def as_dict(self) -> dict:
+        return {
+            'requests': self.requests,
+            'not_modified': self.not_modified,
+            'unchanged': self.unchanged,
+            'hit_rate': round(self.hit_rate, 4)
+        }
+
+
+card_cache_stats = CardCacheStats()
 
 
 class ParsingUtils(BaseUtils):
+    detail_url = 'https://card.wb.ru/cards/detail?spp=27&regions=80,64,38,4,83,33,68,70,69,30,86,75,40,1,22,66,31,48,110,71&pricemarginCoeff=1.0&reg=1&appType=1&emp=0&locale=ru&lang=ru&curr=rub&couponsGeo=12,3,18,15,21&sppFixGeo=4&dest=-455203&nm={nms}'
 
-    async def get_product_data(self, article):
+    async def get_product_data(self, article, detail: dict = None, card_cache: dict[int, CardCache] = None):
         card_url = self.make_head(int(article)) + self.make_tail(str(article), 'ru/card.json')
         obj = {}
-        card = await self.make_get_request(url=card_url, headers={})
-
-        detail_url = f'https://card.wb.ru/cards/detail?spp=27&regions=80,64,38,4,83,33,68,70,69,30,86,75,40,1,22,66,31,48,110,71&pricemarginCoeff=1.0&reg=1&appType=1&emp=0&locale=ru&lang=ru&curr=rub&couponsGeo=12,3,18,15,21&sppFixGeo=4&dest=-455203&nm={article}'
-        detail = await self.make_get_request(detail_url, headers={})
-
-        if detail:
-            detail = detail['data']['products']
+        if card_cache is None:
+            card = await self.make_get_request(url=card_url, headers={})
+            card_unchanged = False
         else:
-            detail = {}
+            card, card_unchanged = await self.get_card(url=card_url, article=int(article), card_cache=card_cache)
+
+        if detail is None:
+            details = await self.get_details(articles=[article])
+            detail = details.get(int(article), {})
 
         obj.update({
             'card': card if card else {},
-            'detail': detail[0] if detail else {},
+            'card_unchanged': card_unchanged,
+            'detail': detail,
             # 'seller': seller_data if seller_data else {}
         })
 
         return obj
 
-    async def get_detail_by_nms(self, nms):
-        output_data = []
-        tasks = []
+    async def get_card(self, url: str, article: int, card_cache: dict[int, CardCache]) -> tuple[dict | None, bool]:
+        """Conditional card.json request, an unchanged card comes back as {'nm_id': article} only."""
+        entry = card_cache.get(article)
+        headers = {}
+        if entry and entry.etag:
+            headers['If-None-Match'] = entry.etag
+        if entry and entry.last_modified:
+            headers['If-Modified-Since'] = entry.last_modified
 
-        for index, nm in enumerate(nms):
-            task = asyncio.create_task(self.get_product_data(article=nm))
-            tasks.append(task)
+        status, body, response_headers = await self.make_conditional_get_request(url=url, headers=headers)
+        card_cache_stats.requests += 1
+        if status == 304 and entry:
+            card_cache_stats.not_modified += 1
+            entry.checked_at = datetime.datetime.now()
+            return {'nm_id': article}, True
+        if status != 200:
+            return None, False
 
-            if index % 100 == 0:
-                print(index, 'product data')
-                output_data += await asyncio.gather(*tasks, return_exceptions=True)
-                tasks = []
+        content_hash = hashlib.sha256(body).hexdigest()
+        unchanged = entry is not None and entry.content_hash == content_hash
+        card_cache[article] = CardCache(
+            nm_id=article,
+            etag=response_headers.get('ETag'),
+            last_modified=response_headers.get('Last-Modified'),
+            content_hash=content_hash,
+            checked_at=datetime.datetime.now()
+        )
+        if unchanged:
+            card_cache_stats.unchanged += 1
+            return {'nm_id': article}, True
+        return json.loads(body), False
 
-        output_data += await asyncio.gather(*tasks, return_exceptions=True)
-        output_data = [item for item in output_data if not isinstance(item, Exception) and item]
-        return output_data
+    async def get_details(self, articles: list) -> dict[int, dict]:
+        """Articles missing from a partial response are asked for once more, the rest get an empty detail."""
+        details = {}
+        missing = [int(article) for article in articles if article is not None]
+        for _ in range(2):
+            if not missing:
+                break
+            data = await self.make_get_request(
+                url=self.detail_url.format(nms=';'.join(str(article) for article in missing)), headers={})
+            for product in data['data']['products'] if data else []:
+                details[product.get('id')] = product
+            missing = [article for article in missing if article not in details]
+        return details
+
+    async def iter_detail_by_nms(
+            self, nms, concurrency: int = None, card_cache: dict[int, CardCache] = None) -> typing.AsyncIterator[dict]:
+        """Streams parsed products, card.json is fetched per article and details per DETAIL_BATCH_SIZE chunk."""
+        nms = list(nms)
+        batch_size = settings.DETAIL_BATCH_SIZE
+        batches: dict[int, asyncio.Future] = {}
+        remaining: dict[int, int] = {}
+
+        async def worker(item):
+            index, nm = item
+            batch = index // batch_size
+            if batch not in batches:
+                batches[batch] = asyncio.ensure_future(
+                    self.get_details(articles=nms[batch * batch_size:(batch + 1) * batch_size]))
+                remaining[batch] = len(nms[batch * batch_size:(batch + 1) * batch_size])
+            try:
+                details = await asyncio.shield(batches[batch])
+            finally:
+                remaining[batch] -= 1
+                if not remaining[batch]:
+                    del remaining[batch]
+                    batches.pop(batch)
+            return await self.get_product_data(article=nm, detail=details.get(int(nm), {}), card_cache=card_cache)
+
+        try:
+            async for product in self.stream_concurrently(
+                    items=enumerate(nms), worker=worker, concurrency=concurrency or settings.PARSING_CONCURRENCY):
+                yield product
+        finally:
+            for future in batches.values():
+                future.cancel()
+
+    async def iter_details_by_nms(self, nms, concurrency: int = None) -> typing.AsyncIterator[dict]:
+        """Streams only the detail endpoint data, DETAIL_BATCH_SIZE articles per request."""
+        nms = list(nms)
+        batch_size = settings.DETAIL_BATCH_SIZE
+        async for details in self.stream_concurrently(
+                items=[nms[index:index + batch_size] for index in range(0, len(nms), batch_size)],
+                worker=lambda articles: self.get_details(articles=articles),
+                concurrency=concurrency or settings.DETAIL_BATCH_CONCURRENCY):
+            for detail in details.values():
+                yield detail
+
+    async def get_detail_by_nms(self, nms):
+        return [product async for product in self.iter_detail_by_nms(nms=nms)]
@@ -0,0 +1,42 @@
+"""Standalone product_monitoring workers: python -m source.product_management.worker --processes 4"""
+import argparse
+import asyncio
+import multiprocessing
+import traceback
+
+from source.core.base_utils import http_client
+from source.core.settings import settings
+from source.product_management.services import ProductServices
+
+
+async def work() -> None:
+    product_services = ProductServices()
+    await http_client.start()
+    try:
+        while True:
+            try:
+                processed = await product_services.monitor_shards()
+            except Exception:
+                traceback.print_exc()
+                processed = 0
+            if not processed:
+                await asyncio.sleep(settings.SHARD_POLL_INTERVAL)
+    finally:
+        await http_client.close()
+
+
+def run_process() -> None:
+    asyncio.run(work())
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--processes', type=int, default=settings.SHARD_WORKER_PROCESSES)
+    args = parser.parse_args()
+
+    context = multiprocessing.get_context('spawn')
+    processes = [context.Process(target=run_process) for _ in range(args.processes)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()